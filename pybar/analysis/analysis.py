@@ -65,8 +65,8 @@ def analyze_beam_spot(scan_base, combine_n_readouts=1000, chunk_size=10000000, p
             progress_bar.start()
 
             # loop over the selected events
-            for parameter_index, parameter_range in enumerate(parameter_ranges):
-                logging.debug('Analyze time stamp ' + str(parameter_range[0]) + ' and data from events = [' + str(parameter_range[2]) + ',' + str(parameter_range[3]) + '[ ' + str(int(float(float(parameter_index) / float(len(parameter_ranges)) * 100.0))) + '%')
+            for parameter_range in parameter_ranges:
+                logging.debug('Analyze time stamp %s and data from events = [%s,%s[', parameter_range[0], parameter_range[2], parameter_range[3])  # progress is shown by the progress bar
                 analyze_data.reset()  # resets the data of the last analysis
 
                 # loop over the hits in the actual selected events with optimizations: determine best chunk size, start word index given
@@ -196,8 +196,8 @@ def analyse_n_cluster_per_event(scan_base, include_no_cluster=False, time_line_a
             progress_bar.start()
 
             # loop over the selected events
-            for parameter_index, parameter_range in enumerate(parameter_ranges):
-                logging.debug('Analyze time stamp ' + str(parameter_range[0]) + ' and data from events = [' + str(parameter_range[2]) + ',' + str(parameter_range[3]) + '[ ' + str(int(float(float(parameter_index) / float(len(parameter_ranges)) * 100.0))) + '%')
+            for parameter_range in parameter_ranges:
+                logging.debug('Analyze time stamp %s and data from events = [%s,%s[', parameter_range[0], parameter_range[2], parameter_range[3])  # progress is shown by the progress bar
                 analyze_data.reset()  # resets the data of the last analysis
 
                 # loop over the cluster in the actual selected events with optimizations: determine best chunk size, start word index given
@@ -360,7 +360,7 @@ def analyze_cluster_size_per_scan_parameter(input_file_hits, output_file_cluster
         logging.info('Analyzed cluster size file ' + output_file_cluster_size + ' already exists. Skip cluster size analysis.')
     else:
         with tb.open_file(output_file_cluster_size, mode="w") as out_file_h5:  # file to write the data into
-            filter_table = tb.Filters(complib='blosc', complevel=5, fletcher32=False)  # compression of the written data
+            filter_table = tb.Filters(complib='blosc:lz4', complevel=5, shuffle=False, bitshuffle=True, fletcher32=False)  # compression of the written histograms
             parameter_goup = out_file_h5.create_group(out_file_h5.root, parameter, title=parameter)  # note to store the data
             cluster_size_total = None  # final array for the cluster size per GDAC
             with tb.open_file(input_file_hits, mode="r+") as in_hit_file_h5:  # open the actual hit file
@@ -387,7 +387,7 @@ def analyze_cluster_size_per_scan_parameter(input_file_hits, output_file_cluster
                         progress_bar.start()
                         for parameter_index, parameter_range in enumerate(parameter_ranges):  # loop over the selected events
                             analyze_data.reset()  # resets the data of the last analysis
-                            logging.debug('Analyze GDAC = ' + str(parameter_range[0]) + ' ' + str(int(float(float(parameter_index) / float(len(parameter_ranges)) * 100.0))) + '%')
+                            logging.debug('Analyze GDAC = %s', parameter_range[0])  # progress is shown by the progress bar
                             start_event_number = parameter_range[1]
                             stop_event_number = parameter_range[2]
                             logging.debug('Data from events = [' + str(start_event_number) + ',' + str(stop_event_number) + '[')
@@ -472,7 +472,7 @@ def histogram_cluster_table(analyzed_data_file, output_file, chunk_size=10000000
                 progress_bar.update(index)
             progress_bar.finish()
 
-            filter_table = tb.Filters(complib='blosc', complevel=5, fletcher32=False)  # compression of the written data
+            filter_table = tb.Filters(complib='blosc:lz4', complevel=5, shuffle=False, bitshuffle=True, fletcher32=False)  # compression of the written histograms
             occupancy_array = histogram.get_occupancy().T
             occupancy_array_table = out_file_h5.create_carray(out_file_h5.root, name='HistOcc', title='Occupancy Histogram', atom=tb.Atom.from_dtype(occupancy_array.dtype), shape=occupancy_array.shape, filters=filter_table)
             occupancy_array_table[:] = occupancy_array
@@ -57,13 +57,13 @@ def generate_threshold_mask(hist):
 
     Returns
     -------
-    masked array
-        Returns copy of the array with masked elements.
+    numpy.array
+        Boolean mask array, True for masked elements.
     '''
-    masked_array = np.ma.masked_values(hist, 0)
-    masked_array = np.ma.masked_greater(masked_array, 10 * np.ma.median(hist))
-    logging.info('Masking %d pixel(s)', np.ma.count_masked(masked_array))
-    return np.ma.getmaskarray(masked_array)
+    hist = np.asarray(hist)
+    mask = np.logical_or(np.isclose(hist, 0), hist > 10 * np.median(hist))
+    logging.info('Masking %d pixel(s)', np.count_nonzero(mask))
+    return mask
 
 
 def unique_row(array, use_columns=None, selected_columns_only=False):
@@ -378,7 +378,7 @@ def get_parameter_value_from_file_names(files, parameters=None, unique=False, so
 
     """
 #     unique=False
-    logging.debug('Get the parameter: ' + str(parameters) + ' values from the file names of ' + str(len(files)) + ' files')
+    logging.debug('Get the parameter: %s values from the file names of %d files', parameters, len(files))
     files_dict = collections.OrderedDict()
     if parameters is None:  # special case, no parameter defined
         return files_dict
@@ -496,7 +496,7 @@ def get_parameter_from_files(files, parameters=None, unique=False, sort=True):
     collections.OrderedDict
 
     '''
-    logging.debug('Get the parameter ' + str(parameters) + ' values from ' + str(len(files)) + ' files')
+    logging.debug('Get the parameter %s values from %d files', parameters, len(files))
     files_dict = collections.OrderedDict()
     if isinstance(files, basestring):
         files = (files, )
@@ -789,7 +789,7 @@ def get_hits_in_events(hits_array, events, assume_sorted=True, condition=None):
         hit array with the hits in events.
     '''
 
-    logging.debug("Calculate hits that exists in the given %d events." % len(events))
+    logging.debug("Calculate hits that exists in the given %d events.", len(events))
     if assume_sorted:
         events, _ = reduce_sorted_to_intersect(events, hits_array['event_number'])  # reduce the event number range to the max min event number of the given hits to save time
         if events.shape[0] == 0:  # if there is not a single selected hit
@@ -849,7 +849,7 @@ def get_hits_of_scan_parameter(input_file_hits, scan_parameters=None, try_speedu
 
         # loop over the selected events
         for parameter_index, (start_event_number, stop_event_number) in enumerate(event_number_ranges):
-            logging.debug('Read hits for ' + str(scan_parameters) + ' = ' + str(parameter_values[parameter_index]))
+            logging.debug('Read hits for %s = %s', scan_parameters, parameter_values[parameter_index])
 
             readout_hit_len = 0  # variable to calculate a optimal chunk size value from the number of hits for speed up
             # loop over the hits in the actual selected events with optimizations: determine best chunk size, start word index given
@@ -929,11 +929,13 @@ def write_hits_in_events(hit_table_in, hit_table_out, events, start_hit_word=0,
     if len(events) > 0:  # needed to avoid crash
         min_event = np.amin(events)
         max_event = np.amax(events)
-        logging.debug("Write hits from hit number >= %d that exists in the selected %d events with %d <= event number <= %d into a new hit table." % (start_hit_word, len(events), min_event, max_event))
+        logging.debug("Write hits from hit number >= %d that exists in the selected %d events with %d <= event number <= %d into a new hit table.", start_hit_word, len(events), min_event, max_event)
         table_size = hit_table_in.shape[0]
+        hits_buffer = np.empty(shape=(max(0, min(chunk_size, table_size - start_hit_word)),), dtype=hit_table_in.dtype)  # reused for every chunk
         iHit = 0
         for iHit in range(start_hit_word, table_size, chunk_size):
-            hits = hit_table_in.read(iHit, iHit + chunk_size)
+            hits = hits_buffer[:min(chunk_size, table_size - iHit)]
+            hit_table_in.read(iHit, iHit + hits.shape[0], out=hits)
             last_event_number = hits[-1]['event_number']
             hit_table_out.append(get_hits_in_events(hits, events=events, condition=condition))
             if last_event_number > max_event:  # speed up, use the fact that the hits are sorted by event_number
@@ -962,10 +964,12 @@ def write_hits_in_event_range(hit_table_in, hit_table_out, event_start=None, eve
         Index of the last hit word analyzed. Used to speed up the next call of write_hits_in_events.
     '''
 
-    logging.debug('Write hits that exists in the given event range from + ' + str(event_start) + ' to ' + str(event_stop) + ' into a new hit table')
+    logging.debug('Write hits that exists in the given event range from + %s to %s into a new hit table', event_start, event_stop)
     table_size = hit_table_in.shape[0]
+    hits_buffer = np.empty(shape=(min(chunk_size, table_size),), dtype=hit_table_in.dtype)  # reused for every chunk
     for iHit in range(0, table_size, chunk_size):
-        hits = hit_table_in.read(iHit, iHit + chunk_size)
+        hits = hits_buffer[:min(chunk_size, table_size - iHit)]
+        hit_table_in.read(iHit, iHit + hits.shape[0], out=hits)
         last_event_number = hits[-1]['event_number']
         selected_hits = get_data_in_event_range(hits, event_start=event_start, event_stop=event_stop)
         if condition is not None:
@@ -1285,9 +1289,13 @@ def data_aligned_at_events(table, start_event_number=None, stop_event_number=Non
                     break
 
         # data loop
+        tail = None  # data of the incomplete last event of the previous chunk, is not read again
         while current_start_index < stop_index:
             current_stop_index = min(current_start_index + chunk_size, stop_index)
-            array_chunk = table.read(start=current_start_index, stop=current_stop_index)  # stop index is exclusive, so add 1
+            if tail is None or tail.shape[0] == 0:
+                array_chunk = table.read(start=current_start_index, stop=current_stop_index)  # stop index is exclusive, so add 1
+            else:
+                array_chunk = np.concatenate((tail, table.read(start=current_start_index + tail.shape[0], stop=current_stop_index)))
             first_event_in_chunk = array_chunk["event_number"][0]
             last_event_in_chunk = array_chunk["event_number"][-1]
 
@@ -1318,6 +1326,7 @@ def data_aligned_at_events(table, start_event_number=None, stop_event_number=Non
                 yield array_chunk[chunk_start_index:chunk_stop_index], current_start_index + nrows + chunk_start_index
 
             current_start_index = current_start_index + nrows + chunk_start_index  # events fully read, increase start index and continue reading
+            tail = array_chunk[chunk_stop_index:]
 
 
 def select_good_pixel_region(hits, col_span, row_span, min_cut_threshold=0.2, max_cut_threshold=2.0):
@@ -1374,9 +1383,9 @@ def get_hit_rate_correction(gdacs, calibration_gdacs, cluster_size_histogram):
     if len(calibration_gdacs) != cluster_size_histogram.shape[0]:
         raise ValueError('Length of the provided pixel GDACs does not match the dimension of the cluster size array')
     hist_sum = np.sum(cluster_size_histogram, axis=1)
-    hist_rel = cluster_size_histogram / hist_sum[:, np.newaxis].astype('f4') * 100.
-    maximum_rate = np.amax(hist_rel[:, 1])
-    correction_factor = maximum_rate / hist_rel[:, 1]
+    single_hit_rel = cluster_size_histogram[:, 1] / hist_sum.astype('f4') * 100.  # only the single hit cluster fraction is needed
+    maximum_rate = np.amax(single_hit_rel)
+    correction_factor = maximum_rate / single_hit_rel
     # sort arrays since interpolate does not work otherwise
     calibration_gdacs_sorted = np.array(calibration_gdacs)
     correction_factor_sorted = correction_factor[np.argsort(calibration_gdacs_sorted)]
@@ -1401,8 +1410,13 @@ def get_mean_threshold_from_calibration(gdac, mean_threshold_calibration):
     numpy.array, shape=(len(gdac), )
         The mean threshold values at each value in gdacs.
     '''
-    interpolation = interp1d(mean_threshold_calibration['parameter_value'], mean_threshold_calibration['mean_threshold'], kind='slinear', bounds_error=True)
-    return interpolation(gdac)
+    # piecewise linear interpolation, np.interp needs increasing x values and does not check the bounds
+    sort_index = np.argsort(mean_threshold_calibration['parameter_value'])
+    parameter_values = mean_threshold_calibration['parameter_value'][sort_index]
+    mean_thresholds = mean_threshold_calibration['mean_threshold'][sort_index]
+    if np.any(np.asarray(gdac) < parameter_values[0]) or np.any(np.asarray(gdac) > parameter_values[-1]):
+        raise ValueError('A GDAC value is outside the calibration range [%s, %s]' % (parameter_values[0], parameter_values[-1]))
+    return np.interp(gdac, parameter_values, mean_thresholds)
 
 
 def get_pixel_thresholds_from_calibration_array(gdacs, calibration_gdacs, threshold_calibration_array, bounds_error=True):
@@ -1424,7 +1438,7 @@ def get_pixel_thresholds_from_calibration_array(gdacs, calibration_gdacs, thresh
     '''
     if len(calibration_gdacs) != threshold_calibration_array.shape[2]:
         raise ValueError('Length of the provided pixel GDACs does not match the third dimension of the calibration array')
-    interpolation = interp1d(x=calibration_gdacs, y=threshold_calibration_array, kind='slinear', bounds_error=bounds_error)
+    interpolation = interp1d(x=calibration_gdacs, y=threshold_calibration_array, kind='linear', copy=False, bounds_error=bounds_error)  # interpolates all pixels at once along the last axis, no copy of the calibration array needed
     return interpolation(gdacs)
 
 
@@ -1555,7 +1569,7 @@ def check_bad_data(raw_data, prepend_data_headers=None, trig_count=None):
 
     # get index of the last trigger
     if n_triggers:
-        last_event_data_headers_cnt = np.where(fe_dh_idx > trigger_idx[-1])[0].shape[0]
+        last_event_data_headers_cnt = n_dh - np.searchsorted(fe_dh_idx, trigger_idx[-1], side='right')  # data header indices are sorted
         if consecutive_triggers and last_event_data_headers_cnt == consecutive_triggers:
             if not np.all(trigger_idx[-1] > fe_dh_idx):
                 trigger_idx = np.r_[trigger_idx, raw_data.shape]
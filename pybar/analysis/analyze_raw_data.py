@@ -13,6 +13,7 @@ from tables import dtype_from_descr, Col
 import numpy as np
 from scipy.optimize import curve_fit, OptimizeWarning
 from scipy.special import erf
+from scipy.cluster.vq import kmeans2
 
 import progressbar
 
@@ -32,19 +33,48 @@ from pybar.daq.readout_utils import is_fe_word, is_data_header, is_trigger_word,
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - [%(levelname)-8s] (%(threadName)-10s) %(message)s")
 
 
-def scurve(x, A, mu, sigma):
-    return 0.5 * A * erf((x - mu) / (np.sqrt(2) * sigma)) + 0.5 * A
+_SQRT_2 = np.sqrt(2)
+_SQRT_2_PI = np.sqrt(2 * np.pi)
 
 
-def fit_scurve(scurve_data, PlsrDAC):  # data of some pixels to fit, has to be global for the multiprocessing module
-    index = np.argmax(np.diff(scurve_data))
-    max_occ = np.median(scurve_data[index:])
-    threshold = PlsrDAC[index]
-    if abs(max_occ) <= 1e-08:  # or index == 0: occupancy is zero or close to zero
+def scurve(x, A, mu, sigma):
+    return 0.5 * A * (erf((x - mu) / (_SQRT_2 * sigma)) + 1)
+
+
+class _ScurveFitFunctions(object):  # scurve() and its analytic Jacobian for one fit (one x array), sharing erf(z) of the last parameters since the Jacobian is requested at already evaluated parameters
+    def __init__(self):
+        self._parameters = None
+        self._z = None
+        self._erf_z = None
+
+    def _update(self, x, A, mu, sigma):
+        if self._parameters != (A, mu, sigma):
+            self._parameters = (A, mu, sigma)
+            self._z = (x - mu) / (_SQRT_2 * sigma)
+            self._erf_z = erf(self._z)
+
+    def scurve(self, x, A, mu, sigma):
+        self._update(x, A, mu, sigma)
+        return 0.5 * A * (self._erf_z + 1)
+
+    def scurve_jac(self, x, A, mu, sigma):  # columns are the derivatives with respect to A, mu, sigma
+        self._update(x, A, mu, sigma)
+        gauss = np.exp(-self._z ** 2) / (sigma * _SQRT_2_PI)
+        return np.column_stack((0.5 * self._erf_z + 0.5, -A * gauss, -A * gauss * (x - mu) / sigma))
+
+
+def fit_scurve(scurve_data, PlsrDAC, p0=None):  # data of some pixels to fit, has to be global for the multiprocessing module
+    if np.ptp(scurve_data) == 0:  # no step in the occupancy (e.g. dead or masked pixel), nothing to fit
+        return [0, 0]
+    if p0 is None:
+        index = np.argmax(np.diff(scurve_data))
+        p0 = [np.median(scurve_data[index:]), PlsrDAC[index], 2.5]
+    if abs(p0[0]) <= 1e-08:  # or index == 0: occupancy is zero or close to zero
         popt = [0, 0, 0]
     else:
         try:
-            popt, _ = curve_fit(scurve, PlsrDAC, scurve_data, p0=[max_occ, threshold, 2.5], check_finite=False)
+            functions = _ScurveFitFunctions()
+            popt, _ = curve_fit(functions.scurve, PlsrDAC, scurve_data, p0=p0, jac=functions.scurve_jac, method='lm', check_finite=False)
         except RuntimeError:  # fit failed
             popt = [0, 0, 0]
     if popt[1] < 0:  # threshold < 0 rarely happens if fit does not work
@@ -52,6 +82,140 @@ def fit_scurve(scurve_data, PlsrDAC):  # data of some pixels to fit, has to be g
     return popt[1:3]
 
 
+def fit_scurves_chunk(scurve_data, PlsrDAC, start_values=None):  # data of some pixels to fit, has to be global for the multiprocessing module
+    if start_values is None:
+        return np.array([fit_scurve(pixel_data, PlsrDAC) for pixel_data in np.asarray(scurve_data, dtype=np.float64)]).reshape(-1, 2)
+    return np.array([fit_scurve(pixel_data, PlsrDAC, p0=p0) for pixel_data, p0 in zip(np.asarray(scurve_data, dtype=np.float64), start_values)]).reshape(-1, 2)
+
+
+def get_scurve_start_values(scurve_data, PlsrDAC, n_clusters=16):
+    '''Calculating the S-curve fit start values of all pixels. The normalized S-curves are grouped by k-means clustering,
+    the threshold and noise start values of each group are taken from the fit of the group mean S-curve.
+
+    Parameters
+    ----------
+    scurve_data : numpy.array
+        Occupancy array with shape (pixels, PlsrDAC values).
+    PlsrDAC : numpy.array
+        Increasing PlsrDAC values.
+    n_clusters : int
+        Number of groups of similar S-curves.
+
+    Returns
+    -------
+    numpy.array with shape (pixels, 3) with amplitude, threshold and noise start values.
+    '''
+    scurve_data = np.asarray(scurve_data, dtype=np.float64)
+    PlsrDAC = np.asarray(PlsrDAC)
+    index = np.argmax(np.diff(scurve_data, axis=1), axis=1)
+    max_occ = np.nanmedian(np.where(np.arange(scurve_data.shape[1])[np.newaxis, :] >= index[:, np.newaxis], scurve_data, np.nan), axis=1)
+    start_values = np.column_stack((max_occ, PlsrDAC[index], np.full(scurve_data.shape[0], 2.5)))
+    selection = np.abs(max_occ) > 1e-08  # occupancy is zero or close to zero
+    n_clusters = min(n_clusters, np.count_nonzero(selection))
+    if n_clusters == 0:
+        return start_values
+    normalized_scurve_data = scurve_data[selection] / max_occ[selection, np.newaxis]
+    # initial groups from S-curves with equally spaced threshold estimates, gives reproducible results
+    threshold_order = np.argsort(index[selection], kind='mergesort')
+    initial_centroids = normalized_scurve_data[threshold_order[np.linspace(0, threshold_order.shape[0] - 1, n_clusters).astype(np.int64)]]
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")  # empty groups are not a problem
+        centroids, labels = kmeans2(normalized_scurve_data, initial_centroids, minit='matrix')
+    pixel_index = np.nonzero(selection)[0]
+    for cluster_index, centroid in enumerate(centroids):
+        cluster_pixel_index = pixel_index[labels == cluster_index]
+        if cluster_pixel_index.shape[0] == 0:
+            continue
+        threshold, noise = fit_scurve(centroid, PlsrDAC)
+        if threshold != 0 or noise != 0:  # fit did not fail
+            start_values[cluster_pixel_index, 1] = threshold
+            start_values[cluster_pixel_index, 2] = noise
+    return start_values
+
+
+def init_scurve_fit_worker(shared_occupancy, shape):  # sets the occupancy array in shared memory for fit_scurves_shared_chunk(), has to be global for the multiprocessing module
+    global _shared_occupancy
+    _shared_occupancy = np.frombuffer(shared_occupancy, dtype=np.float64).reshape(shape)
+
+
+def fit_scurves_shared_chunk(task, PlsrDAC):  # fit pixels task[0] to task[1] of the occupancy array in shared memory with start values task[2], has to be global for the multiprocessing module
+    start, stop, start_values = task
+    return fit_scurves_chunk(_shared_occupancy[start:stop], PlsrDAC, start_values=start_values)
+
+
+def fit_scurves_batched(scurve_data, PlsrDAC, max_iterations=100, ftol=1.49012e-08, xtol=1.49012e-08):
+    '''Fitting the S-curves of many pixels at once with a vectorized Levenberg-Marquardt algorithm. The start values are the same as in fit_scurve().
+    The fit of a pixel stops if the relative reduction of the sum of squares or the relative step size of an accepted step is below ftol or xtol (the MINPACK defaults used by fit_scurve()).
+    The result agrees with fit_scurve() if the rising edge of the S-curve is sampled by several PlsrDAC values. If the noise is smaller than the PlsrDAC step size,
+    the noise is hardly constrained by the data and the result can differ from fit_scurve() (both are then below the PlsrDAC step size).
+
+    Parameters
+    ----------
+    scurve_data : numpy.array
+        Occupancy array with shape (pixels, PlsrDAC values).
+    PlsrDAC : numpy.array
+        Increasing PlsrDAC values.
+    max_iterations : int
+        Maximum number of Levenberg-Marquardt iterations.
+    ftol : float
+        Relative tolerance for the sum of squares.
+    xtol : float
+        Relative tolerance for the fit parameters.
+
+    Returns
+    -------
+    numpy.array with shape (pixels, 2) with threshold and noise. Both are 0 if the fit failed.
+    '''
+    scurve_data = np.asarray(scurve_data, dtype=np.float64)
+    x = np.asarray(PlsrDAC, dtype=np.float64)[np.newaxis, :]
+    index = np.argmax(np.diff(scurve_data, axis=1), axis=1)
+    max_occ = np.nanmedian(np.where(np.arange(scurve_data.shape[1])[np.newaxis, :] >= index[:, np.newaxis], scurve_data, np.nan), axis=1)
+    params = np.column_stack((max_occ, x[0, index], np.full(scurve_data.shape[0], 2.5)))
+    selection = np.logical_and(np.abs(max_occ) > 1e-08, np.ptp(scurve_data, axis=1) != 0)  # occupancy is zero or close to zero or has no step
+    failed = ~selection
+    active = selection.copy()  # pixels that are not converged yet
+    damping = np.full(scurve_data.shape[0], 1e-3)
+
+    def residuals_and_jacobian(params, data):
+        A, mu, sigma = params[:, 0:1], params[:, 1:2], params[:, 2:3]
+        z = (x - mu) / (_SQRT_2 * sigma)
+        gauss = np.exp(-z ** 2) / np.sqrt(np.pi)
+        jacobian = np.dstack((0.5 * (erf(z) + 1), -A * gauss / (_SQRT_2 * sigma), -A * gauss * z / sigma))
+        return A * jacobian[:, :, 0] - data, jacobian
+
+    with np.errstate(all='ignore'):
+        for _ in range(max_iterations):
+            pixel_index = np.nonzero(active)[0]
+            if pixel_index.shape[0] == 0:
+                break
+            residuals, jacobian = residuals_and_jacobian(params[pixel_index], scurve_data[pixel_index])
+            cost = np.sum(residuals ** 2, axis=1)
+            jtj = np.einsum('nki,nkj->nij', jacobian, jacobian)
+            jtr = np.einsum('nki,nk->ni', jacobian, residuals)
+            diagonal = np.diagonal(jtj, axis1=1, axis2=2)
+            jtj[:, np.arange(3), np.arange(3)] += damping[pixel_index, np.newaxis] * diagonal + 1e-12
+            solvable = np.logical_and(np.all(np.isfinite(jtj), axis=(1, 2)), np.all(np.isfinite(jtr), axis=1))  # fit function is degenerated (e.g. sigma = 0)
+            failed[pixel_index[~solvable]] = True
+            active[pixel_index[~solvable]] = False
+            pixel_index, cost, jtj, jtr = pixel_index[solvable], cost[solvable], jtj[solvable], jtr[solvable]
+            if pixel_index.shape[0] == 0:
+                break
+            step = -np.einsum('nij,nj->ni', np.linalg.pinv(jtj), jtr)  # pseudo-inverse, jtj can be numerically singular for S-curves with hardly any points in the rising edge
+            new_params = params[pixel_index] + step
+            new_residuals, _ = residuals_and_jacobian(new_params, scurve_data[pixel_index])
+            new_cost = np.sum(new_residuals ** 2, axis=1)
+            improved = new_cost < cost
+            converged = np.logical_and(improved, np.logical_or(cost - new_cost <= ftol * cost, np.sqrt(np.sum(step ** 2, axis=1)) <= xtol * (np.sqrt(np.sum(new_params ** 2, axis=1)) + xtol)))
+            converged = np.logical_or(converged, damping[pixel_index] > 1e10)  # no improvement possible anymore
+            params[pixel_index[improved]] = new_params[improved]
+            damping[pixel_index] = np.where(improved, damping[pixel_index] / 10., damping[pixel_index] * 10.)
+            active[pixel_index[converged]] = False
+    failed = np.logical_or(failed, ~np.all(np.isfinite(params), axis=1))
+    failed = np.logical_or(failed, params[:, 1] < 0)  # threshold < 0 rarely happens if fit does not work
+    params[failed] = 0
+    return params[:, 1:3]
+
+
 class AnalyzeRawData(object):
 
     """A class to analyze FE-I4 raw data"""
@@ -275,8 +439,11 @@ class AnalyzeRawData(object):
         self.c_low, self.c_mid, self.c_high = None, None, None
         self.c_low_mask, self.c_high_mask = None, None
         self._filter_table = tb.Filters(complib='blosc', complevel=5, fletcher32=False)
+        self._filter_hit_table = tb.Filters(complib='blosc:lz4', complevel=1, fletcher32=False)  # fast compression for the large, write speed limited hit table
+        self._filter_hist = tb.Filters(complib='blosc:lz4', complevel=5, shuffle=False, bitshuffle=True, fletcher32=False)  # histograms with many identical high bits compress better with bit shuffling
         warnings.simplefilter("ignore", OptimizeWarning)
         self.meta_event_index = None
+        self._plsr_dac_values = None
         self.fei4b = False
         self.create_hit_table = False
         self.create_empty_event_hits = False
@@ -299,6 +466,8 @@ class AnalyzeRawData(object):
         self.create_threshold_mask = True  # Threshold/noise histogram mask: masking all pixels out of bounds
         self.create_fitted_threshold_mask = True  # Fitted threshold/noise histogram mask: masking all pixels out of bounds
         self.create_fitted_threshold_hists = False
+        self.vectorized_scurve_fit = False  # fit all S-curves at once with fit_scurves_batched() instead of scipy curve_fit per pixel
+        self.kmeans_scurve_start_values = False  # take the S-curve fit start values from groups of similar S-curves, see get_scurve_start_values()
         self.create_cluster_hit_table = False
         self.create_cluster_table = False
         self.create_cluster_size_hist = False
@@ -325,6 +494,7 @@ class AnalyzeRawData(object):
     def chunk_size(self, value):
         self.interpreter.set_hit_array_size(2 * value)  # worst case: one raw data word becoming 2 hit words
         self._chunk_size = value
+        self._meta_word_buffer = None  # allocated with the new chunk size when needed
 
     @property
     def create_hit_table(self):
@@ -446,6 +616,22 @@ class AnalyzeRawData(object):
     def create_fitted_threshold_hists(self, value):
         self._create_fitted_threshold_hists = value
 
+    @property
+    def vectorized_scurve_fit(self):
+        return self._vectorized_scurve_fit
+
+    @vectorized_scurve_fit.setter
+    def vectorized_scurve_fit(self, value):
+        self._vectorized_scurve_fit = value
+
+    @property
+    def kmeans_scurve_start_values(self):
+        return self._kmeans_scurve_start_values
+
+    @kmeans_scurve_start_values.setter
+    def kmeans_scurve_start_values(self, value):
+        self._kmeans_scurve_start_values = value
+
     @property
     def correct_corrupted_data(self):
         return self._correct_corrupted_data
@@ -658,7 +844,9 @@ class AnalyzeRawData(object):
         logging.info('Interpreting raw data file(s): ' + (', ').join(self.files_dict.keys()))
 
         if self._create_meta_word_index:
-            meta_word = np.empty((self._chunk_size,), dtype=dtype_from_descr(data_struct.MetaInfoWordTable))
+            if self._meta_word_buffer is None:  # reused for all following interpretations with same chunk size
+                self._meta_word_buffer = np.empty((self._chunk_size,), dtype=dtype_from_descr(data_struct.MetaInfoWordTable))
+            meta_word = self._meta_word_buffer
             self.interpreter.set_meta_data_word_index(meta_word)
         self.interpreter.reset_event_variables()
         self.interpreter.reset_counters()
@@ -711,10 +899,11 @@ class AnalyzeRawData(object):
         else:
             self._analyzed_data_file is None
 
+        n_total_words = analysis_utils.get_total_n_data_words(self.files_dict)
         if self._analyzed_data_file is not None:
             if self._create_hit_table is True:
                 description = data_struct.HitInfoTable().columns.copy()
-                hit_table = self.out_file_h5.create_table(self.out_file_h5.root, name='Hits', description=description, title='hit_data', filters=self._filter_table, chunkshape=(self._chunk_size / 100,))
+                hit_table = self.out_file_h5.create_table(self.out_file_h5.root, name='Hits', description=description, title='hit_data', filters=self._filter_hit_table, expectedrows=max(n_total_words, self._chunk_size))  # number of hits is bound by the number of data words
             if self._create_meta_word_index is True:
                 meta_word_index_table = self.out_file_h5.create_table(self.out_file_h5.root, name='EventMetaData', description=data_struct.MetaInfoWordTable, title='event_meta_data', filters=self._filter_table, chunkshape=(self._chunk_size / 10,))
             if self._create_cluster_table:
@@ -723,8 +912,16 @@ class AnalyzeRawData(object):
                 description = data_struct.ClusterHitInfoTable().columns.copy()
                 cluster_hit_table = self.out_file_h5.create_table(self.out_file_h5.root, name='ClusterHits', description=description, title='cluster_hit_data', filters=self._filter_table, expectedrows=self._chunk_size)
 
+        # settings do not change during interpretation, evaluate them once and not for every chunk
+        is_histogram_hits = self.is_histogram_hits()
+        is_cluster_hits = self.is_cluster_hits()
+        store_hit_table = self._analyzed_data_file is not None and self._create_hit_table
+        store_meta_word_index = self._analyzed_data_file is not None and self._create_meta_word_index
+        interpret_raw_data = self.interpreter.interpret_raw_data
+        get_hits = self.interpreter.get_hits
+
         logging.info("Interpreting raw data...")
-        progress_bar = progressbar.ProgressBar(widgets=['', progressbar.Percentage(), ' ', progressbar.Bar(marker='*', left='|', right='|'), ' ', progressbar.AdaptiveETA()], maxval=analysis_utils.get_total_n_data_words(self.files_dict), term_width=80)
+        progress_bar = progressbar.ProgressBar(widgets=['', progressbar.Percentage(), ' ', progressbar.Bar(marker='*', left='|', right='|'), ' ', progressbar.AdaptiveETA()], maxval=n_total_words, term_width=80)
         progress_bar.start()
         total_words = 0
 
@@ -844,10 +1041,15 @@ class AnalyzeRawData(object):
                     consecutive_bad_words_list = consecutive(sorted(bad_word_index))
 
                 lsb_byte = None
+                n_words = in_file_h5.root.raw_data.shape[0]
+                raw_data_buffer = np.empty(shape=(min(self._chunk_size, n_words),), dtype=in_file_h5.root.raw_data.dtype)  # reused for every chunk
+                last_word_index = ((n_words - 1) // self._chunk_size) * self._chunk_size  # start index of the last chunk
+                is_last_file = file_index == len(self.files_dict) - 1
                 # Loop over raw data in chunks
-                for word_index in range(0, in_file_h5.root.raw_data.shape[0], self._chunk_size):  # loop over all words in the actual raw data file
+                for word_index in range(0, n_words, self._chunk_size):  # loop over all words in the actual raw data file
                     try:
-                        raw_data = in_file_h5.root.raw_data.read(word_index, word_index + self._chunk_size)
+                        raw_data = raw_data_buffer[:min(self._chunk_size, n_words - word_index)]
+                        in_file_h5.root.raw_data.read(word_index, word_index + raw_data.shape[0], out=raw_data)
                     except OverflowError, e:
                         logging.error('%s: 2^31 xrange() limitation in 32-bit Python', e)
                     except tb.exceptions.HDF5ExtError:
@@ -873,17 +1075,17 @@ class AnalyzeRawData(object):
                                 else:
                                     break
 
-                    self.interpreter.interpret_raw_data(raw_data)  # interpret the raw data
+                    interpret_raw_data(raw_data)  # interpret the raw data
                     # store remaining buffered event in the interpreter at the end of the last file
-                    if file_index == len(self.files_dict.keys()) - 1 and word_index == range(0, in_file_h5.root.raw_data.shape[0], self._chunk_size)[-1]:  # store hits of the latest event of the last file
+                    if is_last_file and word_index == last_word_index:  # store hits of the latest event of the last file
                         self.interpreter.store_event()
-                    hits = self.interpreter.get_hits()
+                    hits = get_hits()
                     if self.scan_parameters is not None:
                         nEventIndex = self.interpreter.get_n_meta_data_event()
                         self.histogram.add_meta_event_index(self.meta_event_index, nEventIndex)
-                    if self.is_histogram_hits():
+                    if is_histogram_hits:
                         self.histogram_hits(hits)
-                    if self.is_cluster_hits():
+                    if is_cluster_hits:
                         cluster_hits, clusters = self.cluster_hits(hits)
                         if self._create_cluster_hit_table:
                             cluster_hit_table.append(cluster_hits)
@@ -899,9 +1101,9 @@ class AnalyzeRawData(object):
                             if clusters['size'].shape[0] > 0 and np.max(clusters['size']) + 1 > self._cluster_tot_hist.shape[1]:
                                 self._cluster_tot_hist.resize((self._cluster_tot_hist.shape[0], np.max(clusters['size']) + 1))
                             self._cluster_tot_hist += fast_analysis_utils.hist_2d_index(clusters['tot'], clusters['size'], shape=self._cluster_tot_hist.shape)
-                    if self._analyzed_data_file is not None and self._create_hit_table:
+                    if store_hit_table:
                         hit_table.append(hits)
-                    if self._analyzed_data_file is not None and self._create_meta_word_index:
+                    if store_meta_word_index:
                         size = self.interpreter.get_n_meta_data_word()
                         meta_word_index_table.append(meta_word[:size])
 
@@ -936,22 +1138,19 @@ class AnalyzeRawData(object):
                         dtype, _ = self.scan_parameters.dtype.fields[scan_par_name][:2]
                         description[scan_par_name] = Col.from_dtype(dtype, dflt=0, pos=last_pos + index)
                 meta_data_out_table = self.out_file_h5.create_table(self.out_file_h5.root, name='meta_data', description=description, title='MetaData', filters=self._filter_table)
-                entry = meta_data_out_table.row
-                for i in range(0, n_event_index):
-                    if self.interpreter.meta_table_v2:
-                        entry['event_number'] = self.meta_event_index[i][0]  # event index
-                        entry['timestamp_start'] = self.meta_data[i][3]  # timestamp
-                        entry['timestamp_stop'] = self.meta_data[i][4]  # timestamp
-                        entry['error_code'] = self.meta_data[i][5]  # error code
-                    else:
-                        entry['event_number'] = self.meta_event_index[i][0]  # event index
-                        entry['time_stamp'] = self.meta_data[i][3]  # time stamp
-                        entry['error_code'] = self.meta_data[i][4]  # error code
-                    if self.scan_parameters is not None:  # scan parameter if available
-                        for scan_par_name in self.scan_parameters.dtype.names:
-                            entry[scan_par_name] = self.scan_parameters[scan_par_name][i]
-                    entry.append()
-                    self.out_file_h5.flush()
+                meta_data_out = np.zeros((n_event_index,), dtype=meta_data_out_table.dtype)
+                meta_data_out['event_number'] = self.meta_event_index['metaEventIndex'][:n_event_index]  # event index
+                if self.interpreter.meta_table_v2:
+                    meta_data_out['timestamp_start'] = self.meta_data['timestamp_start'][:n_event_index]  # timestamp
+                    meta_data_out['timestamp_stop'] = self.meta_data['timestamp_stop'][:n_event_index]  # timestamp
+                else:
+                    meta_data_out['time_stamp'] = self.meta_data['timestamp'][:n_event_index]  # time stamp
+                meta_data_out['error_code'] = self.meta_data['error'][:n_event_index]  # error code
+                if self.scan_parameters is not None:  # scan parameter if available
+                    for scan_par_name in self.scan_parameters.dtype.names:
+                        meta_data_out[scan_par_name] = self.scan_parameters[scan_par_name][:n_event_index]
+                meta_data_out_table.append(meta_data_out)
+                self.out_file_h5.flush()
                 if self.scan_parameters is not None:
                     logging.info("Save meta data with scan parameter " + scan_par_name)
             else:
@@ -959,22 +1158,22 @@ class AnalyzeRawData(object):
         if self._create_service_record_hist:
             self.service_record_hist = self.interpreter.get_service_records_counters()
             if self._analyzed_data_file is not None:
-                service_record_hist_table = self.out_file_h5.create_carray(self.out_file_h5.root, name='HistServiceRecord', title='Service Record Histogram', atom=tb.Atom.from_dtype(self.service_record_hist.dtype), shape=self.service_record_hist.shape, filters=self._filter_table)
+                service_record_hist_table = self.out_file_h5.create_carray(self.out_file_h5.root, name='HistServiceRecord', title='Service Record Histogram', atom=tb.Atom.from_dtype(self.service_record_hist.dtype), shape=self.service_record_hist.shape, filters=self._filter_hist)
                 service_record_hist_table[:] = self.service_record_hist
         if self._create_tdc_counter_hist:
             self.tdc_counter_hist = self.interpreter.get_tdc_counters()
             if self._analyzed_data_file is not None:
-                tdc_counter_hist = self.out_file_h5.create_carray(self.out_file_h5.root, name='HistTdcCounter', title='All Tdc word counter values', atom=tb.Atom.from_dtype(self.tdc_counter_hist.dtype), shape=self.tdc_counter_hist.shape, filters=self._filter_table)
+                tdc_counter_hist = self.out_file_h5.create_carray(self.out_file_h5.root, name='HistTdcCounter', title='All Tdc word counter values', atom=tb.Atom.from_dtype(self.tdc_counter_hist.dtype), shape=self.tdc_counter_hist.shape, filters=self._filter_hist)
                 tdc_counter_hist[:] = self.tdc_counter_hist
         if self._create_error_hist:
             self.error_counter_hist = self.interpreter.get_error_counters()
             if self._analyzed_data_file is not None:
-                error_counter_hist_table = self.out_file_h5.create_carray(self.out_file_h5.root, name='HistErrorCounter', title='Error Counter Histogram', atom=tb.Atom.from_dtype(self.error_counter_hist.dtype), shape=self.error_counter_hist.shape, filters=self._filter_table)
+                error_counter_hist_table = self.out_file_h5.create_carray(self.out_file_h5.root, name='HistErrorCounter', title='Error Counter Histogram', atom=tb.Atom.from_dtype(self.error_counter_hist.dtype), shape=self.error_counter_hist.shape, filters=self._filter_hist)
                 error_counter_hist_table[:] = self.error_counter_hist
         if self._create_trigger_error_hist:
             self.trigger_error_counter_hist = self.interpreter.get_trigger_error_counters()
             if self._analyzed_data_file is not None:
-                trigger_error_counter_hist_table = self.out_file_h5.create_carray(self.out_file_h5.root, name='HistTriggerErrorCounter', title='Trigger Error Counter Histogram', atom=tb.Atom.from_dtype(self.trigger_error_counter_hist.dtype), shape=self.trigger_error_counter_hist.shape, filters=self._filter_table)
+                trigger_error_counter_hist_table = self.out_file_h5.create_carray(self.out_file_h5.root, name='HistTriggerErrorCounter', title='Trigger Error Counter Histogram', atom=tb.Atom.from_dtype(self.trigger_error_counter_hist.dtype), shape=self.trigger_error_counter_hist.shape, filters=self._filter_hist)
                 trigger_error_counter_hist_table[:] = self.trigger_error_counter_hist
 
         self._create_additional_hit_data()
@@ -985,69 +1184,67 @@ class AnalyzeRawData(object):
         if self._create_tot_hist:
             self.tot_hist = self.histogram.get_tot_hist()
             if self._analyzed_data_file is not None and safe_to_file:
-                tot_hist_table = self.out_file_h5.create_carray(self.out_file_h5.root, name='HistTot', title='ToT Histogram', atom=tb.Atom.from_dtype(self.tot_hist.dtype), shape=self.tot_hist.shape, filters=self._filter_table)
+                tot_hist_table = self.out_file_h5.create_carray(self.out_file_h5.root, name='HistTot', title='ToT Histogram', atom=tb.Atom.from_dtype(self.tot_hist.dtype), shape=self.tot_hist.shape, filters=self._filter_hist)
                 tot_hist_table[:] = self.tot_hist
         if self._create_tot_pixel_hist:
             if self._analyzed_data_file is not None and safe_to_file:
                 self.tot_pixel_hist_array = np.swapaxes(self.histogram.get_tot_pixel_hist(), 0, 1)  # swap axis col,row, parameter --> row, col, parameter
-                tot_pixel_hist_out = self.out_file_h5.create_carray(self.out_file_h5.root, name='HistTotPixel', title='Tot Pixel Histogram', atom=tb.Atom.from_dtype(self.tot_pixel_hist_array.dtype), shape=self.tot_pixel_hist_array.shape, filters=self._filter_table)
+                tot_pixel_hist_out = self.out_file_h5.create_carray(self.out_file_h5.root, name='HistTotPixel', title='Tot Pixel Histogram', atom=tb.Atom.from_dtype(self.tot_pixel_hist_array.dtype), shape=self.tot_pixel_hist_array.shape, filters=self._filter_hist)
                 tot_pixel_hist_out[:] = self.tot_pixel_hist_array
         if self._create_tdc_hist:
             self.tdc_hist = self.histogram.get_tdc_hist()
             if self._analyzed_data_file is not None and safe_to_file:
-                tdc_hist_table = self.out_file_h5.create_carray(self.out_file_h5.root, name='HistTdc', title='Tdc Histogram', atom=tb.Atom.from_dtype(self.tdc_hist.dtype), shape=self.tdc_hist.shape, filters=self._filter_table)
+                tdc_hist_table = self.out_file_h5.create_carray(self.out_file_h5.root, name='HistTdc', title='Tdc Histogram', atom=tb.Atom.from_dtype(self.tdc_hist.dtype), shape=self.tdc_hist.shape, filters=self._filter_hist)
                 tdc_hist_table[:] = self.tdc_hist
         if self._create_tdc_pixel_hist:
             if self._analyzed_data_file is not None and safe_to_file:
                 self.tdc_pixel_hist_array = np.swapaxes(self.histogram.get_tdc_pixel_hist(), 0, 1)  # swap axis col,row, parameter --> row, col, parameter
-                tdc_pixel_hist_out = self.out_file_h5.create_carray(self.out_file_h5.root, name='HistTdcPixel', title='Tdc Pixel Histogram', atom=tb.Atom.from_dtype(self.tdc_pixel_hist_array.dtype), shape=self.tdc_pixel_hist_array.shape, filters=self._filter_table)
+                tdc_pixel_hist_out = self.out_file_h5.create_carray(self.out_file_h5.root, name='HistTdcPixel', title='Tdc Pixel Histogram', atom=tb.Atom.from_dtype(self.tdc_pixel_hist_array.dtype), shape=self.tdc_pixel_hist_array.shape, filters=self._filter_hist)
                 tdc_pixel_hist_out[:] = self.tdc_pixel_hist_array
         if self._create_rel_bcid_hist:
             self.rel_bcid_hist = self.histogram.get_rel_bcid_hist()
             if self._analyzed_data_file is not None and safe_to_file:
                 if not self.set_stop_mode:
-                    rel_bcid_hist_table = self.out_file_h5.create_carray(self.out_file_h5.root, name='HistRelBcid', title='relative BCID Histogram', atom=tb.Atom.from_dtype(self.rel_bcid_hist.dtype), shape=(16, ), filters=self._filter_table)
+                    rel_bcid_hist_table = self.out_file_h5.create_carray(self.out_file_h5.root, name='HistRelBcid', title='relative BCID Histogram', atom=tb.Atom.from_dtype(self.rel_bcid_hist.dtype), shape=(16, ), filters=self._filter_hist)
                     rel_bcid_hist_table[:] = self.rel_bcid_hist[0:16]
                 else:
-                    rel_bcid_hist_table = self.out_file_h5.create_carray(self.out_file_h5.root, name='HistRelBcid', title='relative BCID Histogram in stop mode read out', atom=tb.Atom.from_dtype(self.rel_bcid_hist.dtype), shape=self.rel_bcid_hist.shape, filters=self._filter_table)
+                    rel_bcid_hist_table = self.out_file_h5.create_carray(self.out_file_h5.root, name='HistRelBcid', title='relative BCID Histogram in stop mode read out', atom=tb.Atom.from_dtype(self.rel_bcid_hist.dtype), shape=self.rel_bcid_hist.shape, filters=self._filter_hist)
                     rel_bcid_hist_table[:] = self.rel_bcid_hist
         if self._create_occupancy_hist:
             self.occupancy_array = np.swapaxes(self.histogram.get_occupancy(), 0, 1)  # swap axis col,row, parameter --> row, col, parameter
             if self._analyzed_data_file is not None and safe_to_file:
-                occupancy_array_table = self.out_file_h5.create_carray(self.out_file_h5.root, name='HistOcc', title='Occupancy Histogram', atom=tb.Atom.from_dtype(self.occupancy_array.dtype), shape=self.occupancy_array.shape, filters=self._filter_table)
+                occupancy_array_table = self.out_file_h5.create_carray(self.out_file_h5.root, name='HistOcc', title='Occupancy Histogram', atom=tb.Atom.from_dtype(self.occupancy_array.dtype), shape=self.occupancy_array.shape, filters=self._filter_hist, chunkshape=(self.occupancy_array.shape[0], self.occupancy_array.shape[1], 1))  # one chunk per scan parameter value
                 occupancy_array_table[0:336, 0:80, 0:self.histogram.get_n_parameters()] = self.occupancy_array
         if self._create_mean_tot_hist:
             self.mean_tot_array = np.swapaxes(self.histogram.get_mean_tot(), 0, 1)  # swap axis col,row, parameter --> row, col, parameter
             if self._analyzed_data_file is not None and safe_to_file:
-                mean_tot_array_table = self.out_file_h5.create_carray(self.out_file_h5.root, name='HistMeanTot', title='Mean ToT Histogram', atom=tb.Atom.from_dtype(self.mean_tot_array.dtype), shape=self.mean_tot_array.shape, filters=self._filter_table)
+                mean_tot_array_table = self.out_file_h5.create_carray(self.out_file_h5.root, name='HistMeanTot', title='Mean ToT Histogram', atom=tb.Atom.from_dtype(self.mean_tot_array.dtype), shape=self.mean_tot_array.shape, filters=self._filter_hist)
                 mean_tot_array_table[0:336, 0:80, 0:self.histogram.get_n_parameters()] = self.mean_tot_array
         if self._create_threshold_hists:
-            _, scan_parameters_idx = np.unique(self.scan_parameters['PlsrDAC'], return_index=True)
-            scan_parameters = self.scan_parameters['PlsrDAC'][np.sort(scan_parameters_idx)]
+            scan_parameters = self._get_plsr_dac_values()
             if scan_parameters[0] >= scan_parameters[-1]:
                 raise analysis_utils.AnalysisError('Scan parameter PlsrDAC not increasing')
             threshold, noise = np.zeros(80 * 336, dtype=np.float64), np.zeros(80 * 336, dtype=np.float64)
             # calling fast algorithm function: M. Mertens, PhD thesis, Juelich 2010, note: noise zero if occupancy was zero
-            self.histogram.calculate_threshold_scan_arrays(threshold, noise, self._n_injection, np.min(self.scan_parameters['PlsrDAC']), np.max(self.scan_parameters['PlsrDAC']))
-            threshold_hist, noise_hist = np.reshape(a=threshold.view(), newshape=(80, 336), order='F'), np.reshape(a=noise.view(), newshape=(80, 336), order='F')
-            self.threshold_hist, self.noise_hist = np.swapaxes(threshold_hist, 0, 1), np.swapaxes(noise_hist, 0, 1)
+            self.histogram.calculate_threshold_scan_arrays(threshold, noise, self._n_injection, np.min(scan_parameters), np.max(scan_parameters))
+            # column index is running fastest, so the arrays are already in row, col order
+            self.threshold_hist, self.noise_hist = threshold.reshape((336, 80)), noise.reshape((336, 80))
             if self._analyzed_data_file is not None and safe_to_file:
-                threshold_hist_table = self.out_file_h5.create_carray(self.out_file_h5.root, name='HistThreshold', title='Threshold Histogram', atom=tb.Atom.from_dtype(self.threshold_hist.dtype), shape=(336, 80), filters=self._filter_table)
+                threshold_hist_table = self.out_file_h5.create_carray(self.out_file_h5.root, name='HistThreshold', title='Threshold Histogram', atom=tb.Atom.from_dtype(self.threshold_hist.dtype), shape=(336, 80), filters=self._filter_hist)
                 threshold_hist_table[:] = self.threshold_hist
-                noise_hist_table = self.out_file_h5.create_carray(self.out_file_h5.root, name='HistNoise', title='Noise Histogram', atom=tb.Atom.from_dtype(self.noise_hist.dtype), shape=(336, 80), filters=self._filter_table)
+                noise_hist_table = self.out_file_h5.create_carray(self.out_file_h5.root, name='HistNoise', title='Noise Histogram', atom=tb.Atom.from_dtype(self.noise_hist.dtype), shape=(336, 80), filters=self._filter_hist)
                 noise_hist_table[:] = self.noise_hist
         if self._create_fitted_threshold_hists:
-            _, scan_parameters_idx = np.unique(self.scan_parameters['PlsrDAC'], return_index=True)
-            scan_parameters = self.scan_parameters['PlsrDAC'][np.sort(scan_parameters_idx)]
-            self.scurve_fit_results = self.fit_scurves_multithread(self.out_file_h5, PlsrDAC=scan_parameters)
+            scan_parameters = self._get_plsr_dac_values()
+            self.scurve_fit_results = self.fit_scurves_multithread(self.out_file_h5, PlsrDAC=scan_parameters, vectorized=self._vectorized_scurve_fit, kmeans_start_values=self._kmeans_scurve_start_values)
             if self._analyzed_data_file is not None and safe_to_file:
-                fitted_threshold_hist_table = self.out_file_h5.create_carray(self.out_file_h5.root, name='HistThresholdFitted', title='Threshold Fitted Histogram', atom=tb.Atom.from_dtype(self.scurve_fit_results.dtype), shape=(336, 80), filters=self._filter_table)
-                fitted_noise_hist_table = self.out_file_h5.create_carray(self.out_file_h5.root, name='HistNoiseFitted', title='Noise Fitted Histogram', atom=tb.Atom.from_dtype(self.scurve_fit_results.dtype), shape=(336, 80), filters=self._filter_table)
+                fitted_threshold_hist_table = self.out_file_h5.create_carray(self.out_file_h5.root, name='HistThresholdFitted', title='Threshold Fitted Histogram', atom=tb.Atom.from_dtype(self.scurve_fit_results.dtype), shape=(336, 80), filters=self._filter_hist)
+                fitted_noise_hist_table = self.out_file_h5.create_carray(self.out_file_h5.root, name='HistNoiseFitted', title='Noise Fitted Histogram', atom=tb.Atom.from_dtype(self.scurve_fit_results.dtype), shape=(336, 80), filters=self._filter_hist)
                 fitted_threshold_hist_table.attrs.dimensions, fitted_noise_hist_table.attrs.dimensions = 'column, row, PlsrDAC', 'column, row, PlsrDAC'
                 fitted_threshold_hist_table[:], fitted_noise_hist_table[:] = self.scurve_fit_results[:, :, 0], self.scurve_fit_results[:, :, 1]
 
-                fitted_threshold_hist_table = self.out_file_h5.create_carray(self.out_file_h5.root, name='HistThresholdFittedCalib', title='Threshold Fitted Histogram with PlsrDAC clalibration', atom=tb.Atom.from_dtype(self.scurve_fit_results.dtype), shape=(336, 80), filters=self._filter_table)
-                fitted_noise_hist_table = self.out_file_h5.create_carray(self.out_file_h5.root, name='HistNoiseFittedCalib', title='Noise Fitted Histogram with PlsrDAC clalibration', atom=tb.Atom.from_dtype(self.scurve_fit_results.dtype), shape=(336, 80), filters=self._filter_table)
+                fitted_threshold_hist_table = self.out_file_h5.create_carray(self.out_file_h5.root, name='HistThresholdFittedCalib', title='Threshold Fitted Histogram with PlsrDAC clalibration', atom=tb.Atom.from_dtype(self.scurve_fit_results.dtype), shape=(336, 80), filters=self._filter_hist)
+                fitted_noise_hist_table = self.out_file_h5.create_carray(self.out_file_h5.root, name='HistNoiseFittedCalib', title='Noise Fitted Histogram with PlsrDAC clalibration', atom=tb.Atom.from_dtype(self.scurve_fit_results.dtype), shape=(336, 80), filters=self._filter_hist)
                 fitted_threshold_hist_table.attrs.dimensions, fitted_noise_hist_table.attrs.dimensions = 'column, row, electrons', 'column, row, electrons'
                 self.threshold_hist_calib, self.noise_hist_calib = self._get_plsr_dac_charge(self.scurve_fit_results[:, :, 0]), self._get_plsr_dac_charge(self.scurve_fit_results[:, :, 1], no_offset=True)
                 fitted_threshold_hist_table[:], fitted_noise_hist_table[:] = self.threshold_hist_calib, self.noise_hist_calib
@@ -1056,12 +1253,12 @@ class AnalyzeRawData(object):
         logging.info('Create selected cluster histograms')
         if self._create_cluster_size_hist:
             if self._analyzed_data_file is not None and safe_to_file:
-                cluster_size_hist_table = self.out_file_h5.create_carray(self.out_file_h5.root, name='HistClusterSize', title='Cluster Size Histogram', atom=tb.Atom.from_dtype(self._cluster_size_hist.dtype), shape=self._cluster_size_hist.shape, filters=self._filter_table)
+                cluster_size_hist_table = self.out_file_h5.create_carray(self.out_file_h5.root, name='HistClusterSize', title='Cluster Size Histogram', atom=tb.Atom.from_dtype(self._cluster_size_hist.dtype), shape=self._cluster_size_hist.shape, filters=self._filter_hist)
                 cluster_size_hist_table[:] = self._cluster_size_hist
         if self._create_cluster_tot_hist:
             self._cluster_tot_hist[:, 0] = self._cluster_tot_hist.sum(axis=1)  # First bin is the projection of the others
             if self._analyzed_data_file is not None and safe_to_file:
-                cluster_tot_hist_table = self.out_file_h5.create_carray(self.out_file_h5.root, name='HistClusterTot', title='Cluster Tot Histogram', atom=tb.Atom.from_dtype(self._cluster_tot_hist.dtype), shape=self._cluster_tot_hist.shape, filters=self._filter_table)
+                cluster_tot_hist_table = self.out_file_h5.create_carray(self.out_file_h5.root, name='HistClusterTot', title='Cluster Tot Histogram', atom=tb.Atom.from_dtype(self._cluster_tot_hist.dtype), shape=self._cluster_tot_hist.shape, filters=self._filter_hist)
                 cluster_tot_hist_table[:] = self._cluster_tot_hist
 
     def analyze_hit_table(self, analyzed_data_file=None, analyzed_data_out_file=None):
@@ -1087,7 +1284,7 @@ class AnalyzeRawData(object):
                 analyzed_data_file = os.path.abspath(analyzed_data_file)
                 if os.path.splitext(analyzed_data_file)[1].lower() != ".h5":
                     analyzed_data_file = os.path.splitext(analyzed_data_file)[0] + ".h5"
-                in_file_h5 = tb.open_file(analyzed_data_file, mode="r+")
+                in_file_h5 = tb.open_file(analyzed_data_file, mode="r+", CHUNK_CACHE_SIZE=64 * 1024 * 1024, CHUNK_CACHE_NELMTS=100003)  # large HDF5 chunk cache for the chunked hit table read
                 close_analyzed_data_file = True
         elif self.is_open(self.out_file_h5):
                 in_file_h5 = self.out_file_h5
@@ -1152,6 +1349,11 @@ class AnalyzeRawData(object):
 
         table_size = in_file_h5.root.Hits.nrows
         n_hits = 0  # number of hits in actual chunk
+        # settings do not change during the analysis, evaluate them once and not for every chunk
+        is_cluster_hits = self.is_cluster_hits()
+        is_histogram_hits = self.is_histogram_hits()
+        store_cluster_hit_table = self._analyzed_data_file is not None and self._create_cluster_hit_table
+        store_cluster_table = self._analyzed_data_file is not None and self._create_cluster_table
 
         logging.info('Analyzing hits...')
         progress_bar = progressbar.ProgressBar(widgets=['', progressbar.Percentage(), ' ', progressbar.Bar(marker='*', left='|', right='|'), ' ', progressbar.AdaptiveETA()], maxval=table_size, term_width=80)
@@ -1160,15 +1362,15 @@ class AnalyzeRawData(object):
         for hits, index in analysis_utils.data_aligned_at_events(in_file_h5.root.Hits, chunk_size=self._chunk_size):
             n_hits += hits.shape[0]
 
-            if self.is_cluster_hits():
+            if is_cluster_hits:
                 cluster_hits, clusters = self.cluster_hits(hits)
 
-            if self.is_histogram_hits():
+            if is_histogram_hits:
                 self.histogram_hits(hits)
 
-            if self._analyzed_data_file is not None and self._create_cluster_hit_table:
+            if store_cluster_hit_table:
                 cluster_hit_table.append(cluster_hits)
-            if self._analyzed_data_file is not None and self._create_cluster_table:
+            if store_cluster_table:
                 cluster_table.append(clusters)
                 if self._create_cluster_size_hist:
                     if clusters['size'].shape[0] > 0 and np.max(clusters['size']) + 1 > self._cluster_size_hist.shape[0]:
@@ -1205,7 +1407,7 @@ class AnalyzeRawData(object):
 
     def analyze_hits(self, hits, scan_parameter=None):
         n_hits = hits.shape[0]
-        logging.debug('Analyze %d hits' % n_hits)
+        logging.debug('Analyze %d hits', n_hits)
 
         if scan_parameter is None:  # if nothing specified keep actual setting
             logging.debug('Keep scan parameter settings ')
@@ -1230,13 +1432,19 @@ class AnalyzeRawData(object):
         return cluster_hits, clusters
 
     def cluster_hits(self, hits, start_index=None, stop_index=None):
-        return self.clusterizer.cluster_hits(hits[start_index:stop_index])
+        if start_index is not None or stop_index is not None:
+            hits = hits[start_index:stop_index]
+        return self.clusterizer.cluster_hits(hits)
 
     def histogram_hits(self, hits, start_index=None, stop_index=None):
-        self.histogram.add_hits(hits[start_index:stop_index])
+        if start_index is not None or stop_index is not None:
+            hits = hits[start_index:stop_index]
+        self.histogram.add_hits(hits)
 
     def histogram_cluster_seed_hits(self, clusters, start_index=None, stop_index=None):
-        self.histogram.add_hits(clusters[start_index:stop_index])
+        if start_index is not None or stop_index is not None:
+            clusters = clusters[start_index:stop_index]
+        self.histogram.add_hits(clusters)
 
     def plot_histograms(self, pdf_filename=None, analyzed_data_file=None, maximum=None, create_hit_hists_only=False):  # plots the histogram from output file if available otherwise from ram
         logging.info('Creating histograms%s', (' (source: %s)' % analyzed_data_file) if analyzed_data_file is not None else (' (source: %s)' % self._analyzed_data_file) if self._analyzed_data_file is not None else '')
@@ -1274,41 +1482,44 @@ class AnalyzeRawData(object):
             raise ValueError('Parameter "pdf_filename" not specified.')
         logging.info('Saving histograms to PDF file: %s', str(output_pdf._file.fh.name))
         if self._create_threshold_hists:
+            # read each histogram only once
+            threshold_hist = out_file_h5.root.HistThreshold[:] if out_file_h5 is not None else self.threshold_hist
+            noise_hist = out_file_h5.root.HistNoise[:] if out_file_h5 is not None else self.noise_hist
             if self._create_threshold_mask:  # mask pixel with bad data for plotting
-                if out_file_h5 is not None:
-                    self.threshold_mask = analysis_utils.generate_threshold_mask(out_file_h5.root.HistNoise[:])
-                else:
-                    self.threshold_mask = analysis_utils.generate_threshold_mask(self.noise_hist)
-            else:
-                self.threshold_mask = np.zeros_like(out_file_h5.root.HistThreshold[:] if out_file_h5 is not None else self.threshold_hist, dtype=np.bool)
-            threshold_hist = np.ma.array(out_file_h5.root.HistThreshold[:] if out_file_h5 is not None else self.threshold_hist, mask=self.threshold_mask)
-            noise_hist = np.ma.array(out_file_h5.root.HistNoise[:] if out_file_h5 is not None else self.noise_hist, mask=self.threshold_mask)
-            mask_cnt = np.ma.count_masked(noise_hist)
-            logging.info('Fast algorithm: masking %d pixel(s)', mask_cnt)
+                self.threshold_mask = analysis_utils.generate_threshold_mask(noise_hist)
+                threshold_hist = np.ma.array(threshold_hist, mask=self.threshold_mask)
+                noise_hist = np.ma.array(noise_hist, mask=self.threshold_mask)
+                mask_cnt = np.count_nonzero(self.threshold_mask)
+                logging.info('Fast algorithm: masking %d pixel(s)', mask_cnt)
+            else:  # plot plain arrays
+                self.threshold_mask = np.zeros_like(threshold_hist, dtype=np.bool)
+                mask_cnt = 0
             plotting.plot_three_way(hist=threshold_hist, title='Threshold%s' % ((' (masked %i pixel(s))' % mask_cnt) if self._create_threshold_mask else ''), x_axis_title="threshold [PlsrDAC]", filename=output_pdf, bins=100, minimum=0, maximum=maximum)
             plotting.plot_three_way(hist=noise_hist, title='Noise%s' % ((' (masked %i pixel(s))' % mask_cnt) if self._create_threshold_mask else ''), x_axis_title="noise [PlsrDAC]", filename=output_pdf, bins=100, minimum=0, maximum=maximum)
         if self._create_fitted_threshold_hists:
+            # read each histogram only once
+            threshold_hist = out_file_h5.root.HistThresholdFitted[:] if out_file_h5 is not None else self.scurve_fit_results[:, :, 0]
+            noise_hist = out_file_h5.root.HistNoiseFitted[:] if out_file_h5 is not None else self.scurve_fit_results[:, :, 1]
+            threshold_hist_calib = out_file_h5.root.HistThresholdFittedCalib[:] if out_file_h5 is not None else self.threshold_hist_calib[:]
+            noise_hist_calib = out_file_h5.root.HistNoiseFittedCalib[:] if out_file_h5 is not None else self.noise_hist_calib[:]
             if self._create_fitted_threshold_mask:
-                if out_file_h5 is not None:
-                    self.fitted_threshold_mask = analysis_utils.generate_threshold_mask(out_file_h5.root.HistNoiseFitted[:])
-                else:
-                    self.fitted_threshold_mask = analysis_utils.generate_threshold_mask(self.scurve_fit_results[:, :, 1])
-            else:
-                self.threshold_mask = np.zeros_like(out_file_h5.root.HistThresholdFitted[:] if out_file_h5 is not None else self.scurve_fit_results, dtype=np.bool8)
-            threshold_hist = np.ma.array(out_file_h5.root.HistThresholdFitted[:] if out_file_h5 is not None else self.scurve_fit_results[:, :, 0], mask=self.fitted_threshold_mask)
-            noise_hist = np.ma.array(out_file_h5.root.HistNoiseFitted[:] if out_file_h5 is not None else self.scurve_fit_results[:, :, 1], mask=self.fitted_threshold_mask)
-            threshold_hist_calib = np.ma.array(out_file_h5.root.HistThresholdFittedCalib[:] if out_file_h5 is not None else self.threshold_hist_calib[:], mask=self.fitted_threshold_mask)
-            noise_hist_calib = np.ma.array(out_file_h5.root.HistNoiseFittedCalib[:] if out_file_h5 is not None else self.noise_hist_calib[:], mask=self.fitted_threshold_mask)
-            mask_cnt = np.ma.count_masked(noise_hist)
-            logging.info('S-curve fit: masking %d pixel(s)', mask_cnt)
+                self.fitted_threshold_mask = analysis_utils.generate_threshold_mask(noise_hist)
+                threshold_hist = np.ma.array(threshold_hist, mask=self.fitted_threshold_mask)
+                noise_hist = np.ma.array(noise_hist, mask=self.fitted_threshold_mask)
+                threshold_hist_calib = np.ma.array(threshold_hist_calib, mask=self.fitted_threshold_mask)
+                noise_hist_calib = np.ma.array(noise_hist_calib, mask=self.fitted_threshold_mask)
+                mask_cnt = np.count_nonzero(self.fitted_threshold_mask)
+                logging.info('S-curve fit: masking %d pixel(s)', mask_cnt)
+            else:  # plot plain arrays
+                self.fitted_threshold_mask = np.zeros_like(threshold_hist, dtype=np.bool)
+                mask_cnt = 0
             plotting.plot_three_way(hist=threshold_hist, title='Threshold (S-curve fit, masked %i pixel(s))' % mask_cnt, x_axis_title="Threshold [PlsrDAC]", filename=output_pdf, bins=100, minimum=0, maximum=maximum)
             plotting.plot_three_way(hist=noise_hist, title='Noise (S-curve fit, masked %i pixel(s))' % mask_cnt, x_axis_title="Noise [PlsrDAC]", filename=output_pdf, bins=100, minimum=0, maximum=maximum)
             plotting.plot_three_way(hist=threshold_hist_calib, title='Threshold (S-curve fit, masked %i pixel(s))' % mask_cnt, x_axis_title="Threshold [e]", filename=output_pdf, bins=100, minimum=0)
             plotting.plot_three_way(hist=noise_hist_calib, title='Noise (S-curve fit, masked %i pixel(s))' % mask_cnt, x_axis_title="Noise [e]", filename=output_pdf, bins=100, minimum=0)
         if self._create_occupancy_hist:
             if self._create_fitted_threshold_hists:
-                _, scan_parameters_idx = np.unique(self.scan_parameters['PlsrDAC'], return_index=True)
-                scan_parameters = self.scan_parameters['PlsrDAC'][np.sort(scan_parameters_idx)]
+                scan_parameters = self._get_plsr_dac_values()
                 plotting.plot_scurves(occupancy_hist=out_file_h5.root.HistOcc[:] if out_file_h5 is not None else self.occupancy_array[:], filename=output_pdf, scan_parameters=scan_parameters, scan_parameter_name="PlsrDAC")
             else:
                 hist = np.sum(out_file_h5.root.HistOcc[:], axis=2) if out_file_h5 is not None else np.sum(self.occupancy_array[:], axis=2)
@@ -1333,9 +1544,10 @@ class AnalyzeRawData(object):
         if self._create_cluster_size_hist:
             plotting.plot_cluster_size(hist=out_file_h5.root.HistClusterSize[:] if out_file_h5 is not None else self.cluster_size_hist, filename=output_pdf)
         if self._create_cluster_tot_hist:
-            plotting.plot_cluster_tot(hist=out_file_h5.root.HistClusterTot[:] if out_file_h5 is not None else self.cluster_tot_hist, filename=output_pdf)
-        if self._create_cluster_tot_hist and self._create_cluster_size_hist:
-            plotting.plot_cluster_tot_size(hist=out_file_h5.root.HistClusterTot[:] if out_file_h5 is not None else self.cluster_tot_hist, filename=output_pdf)
+            cluster_tot_hist = out_file_h5.root.HistClusterTot[:] if out_file_h5 is not None else self.cluster_tot_hist
+            plotting.plot_cluster_tot(hist=cluster_tot_hist, filename=output_pdf)
+            if self._create_cluster_size_hist:
+                plotting.plot_cluster_tot_size(hist=cluster_tot_hist, filename=output_pdf)
         if self._create_rel_bcid_hist:
             if self.set_stop_mode:
                 plotting.plot_relative_bcid_stop_mode(hist=out_file_h5.root.HistRelBcid[:] if out_file_h5 is not None else self.rel_bcid_hist, filename=output_pdf)
@@ -1360,24 +1572,62 @@ class AnalyzeRawData(object):
             logging.info('Closing output PDF file: %s', str(output_pdf._file.fh.name))
             output_pdf.close()
 
-    def fit_scurves_multithread(self, hit_table_file=None, PlsrDAC=None):
-        logging.info("Start S-curve fit on %d CPU core(s)", mp.cpu_count())
+    def fit_scurves_multithread(self, hit_table_file=None, PlsrDAC=None, vectorized=False, kmeans_start_values=False):
+        '''Fitting the S-curves of all pixels.
+
+        Parameters
+        ----------
+        hit_table_file : tables.file.File
+            File with the occupancy histogram. If None, the occupancy histogram in memory is used.
+        PlsrDAC : numpy.array
+            PlsrDAC values of the occupancy histogram.
+        vectorized : bool
+            If True, all pixels are fitted at once in this process by fit_scurves_batched(), otherwise each pixel is fitted by scipy curve_fit on all CPU cores.
+        kmeans_start_values : bool
+            If True, the start values of the scipy curve_fit fits are taken from get_scurve_start_values(), otherwise from the largest occupancy step of each pixel.
+        '''
         occupancy_hist = hit_table_file.root.HistOcc[:] if hit_table_file is not None else self.occupancy_array[:]  # take data from RAM if no file is opened
         occupancy_hist_shaped = occupancy_hist.reshape(occupancy_hist.shape[0] * occupancy_hist.shape[1], occupancy_hist.shape[2])
         # reverse data to fit s-curve
         if PlsrDAC[0] > PlsrDAC[-1]:
             occupancy_hist_shaped = np.flip(occupancy_hist_shaped, axis=1)
             PlsrDAC = np.flip(PlsrDAC, axis=0)
-        partialfit_scurve = partial(fit_scurve, PlsrDAC=PlsrDAC)  # trick to give a function more than one parameter, needed for pool.map
-        pool = mp.Pool()  # create as many workers as physical cores are available
+        if vectorized:
+            logging.info("Start vectorized S-curve fit")
+            if len(PlsrDAC) < 3:
+                raise analysis_utils.NotSupportedError('Less than 3 points found for S-curve fit.')
+            result_array = fit_scurves_batched(occupancy_hist_shaped, PlsrDAC)
+            logging.info("S-curve fit finished")
+            return result_array.reshape(occupancy_hist.shape[0], occupancy_hist.shape[1], 2)
         try:
-            result_list = pool.map(partialfit_scurve, occupancy_hist_shaped.tolist())
+            start_values = get_scurve_start_values(occupancy_hist_shaped, PlsrDAC) if kmeans_start_values else None
+            if occupancy_hist_shaped.shape[0] < 1000:  # few pixels, not worth starting processes
+                logging.info("Start S-curve fit")
+                result_array = fit_scurves_chunk(occupancy_hist_shaped, PlsrDAC=PlsrDAC, start_values=start_values)
+            else:
+                logging.info("Start S-curve fit on %d CPU core(s)", mp.cpu_count())
+                # the occupancy is copied once into shared memory, the workers only receive the pixel index range to fit
+                shared_occupancy = mp.RawArray('d', occupancy_hist_shaped.size)
+                np.frombuffer(shared_occupancy, dtype=np.float64).reshape(occupancy_hist_shaped.shape)[:] = occupancy_hist_shaped
+                # at least one chunk of pixels per core and at most 2000 pixels per chunk to show the progress
+                chunk_limits = np.linspace(0, occupancy_hist_shaped.shape[0], max(mp.cpu_count(), occupancy_hist_shaped.shape[0] // 2000) + 1).astype(np.int64)
+                partialfit_scurves = partial(fit_scurves_shared_chunk, PlsrDAC=PlsrDAC)  # trick to give a function more than one parameter, needed for pool.map
+                progress_bar = progressbar.ProgressBar(widgets=['', progressbar.Percentage(), ' ', progressbar.Bar(marker='*', left='|', right='|'), ' ', progressbar.AdaptiveETA()], maxval=occupancy_hist_shaped.shape[0], term_width=80)
+                progress_bar.start()
+                pool = mp.Pool(initializer=init_scurve_fit_worker, initargs=(shared_occupancy, occupancy_hist_shaped.shape))  # create as many workers as physical cores are available
+                try:
+                    result_list = []
+                    tasks = [(start, stop, start_values[start:stop] if start_values is not None else None) for start, stop in zip(chunk_limits[:-1], chunk_limits[1:])]
+                    for result in pool.imap(partialfit_scurves, tasks):  # results are returned in order of the chunks
+                        result_list.append(result)
+                        progress_bar.update(progress_bar.currval + len(result))
+                    result_array = np.concatenate(result_list)
+                finally:
+                    pool.close()
+                    pool.join()
+                progress_bar.finish()
         except TypeError:
             raise analysis_utils.NotSupportedError('Less than 3 points found for S-curve fit.')
-        finally:
-            pool.close()
-            pool.join()
-        result_array = np.array(result_list)
         logging.info("S-curve fit finished")
         return result_array.reshape(occupancy_hist.shape[0], occupancy_hist.shape[1], 2)
 
@@ -1430,6 +1680,14 @@ class AnalyzeRawData(object):
         except IndexError:  # happens if setting is not available (e.g. repeat_command)
             pass
 
+    def _get_plsr_dac_values(self):
+        '''Returns the PlsrDAC values of the scan parameter table in order of appearance. The result is cached as long as the scan parameter table is not replaced.
+        '''
+        if self._plsr_dac_values is None or self._plsr_dac_values[0] is not self.scan_parameters:
+            _, scan_parameters_idx = np.unique(self.scan_parameters['PlsrDAC'], return_index=True)
+            self._plsr_dac_values = (self.scan_parameters, np.ascontiguousarray(self.scan_parameters['PlsrDAC'][np.sort(scan_parameters_idx)]))
+        return self._plsr_dac_values[1]
+
     def _get_plsr_dac_charge(self, plsr_dac_array, no_offset=False):
         '''Takes the PlsrDAC calibration and the stored C-high/C-low mask to calculate the charge from the PlsrDAC array on a pixel basis
         '''
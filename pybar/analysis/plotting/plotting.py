@@ -234,7 +234,11 @@ def plot_occupancy(hist, title='Occupancy', z_max=None, filename=None):
 
 
 def make_occupancy_hist(cols, rows, ncols=80, nrows=336):
-    hist, _, _ = np.histogram2d(rows, cols, bins=(nrows, ncols), range=[[1, nrows], [1, ncols]])
+    # cols and rows are integer pixel indices starting at 1, count them directly instead of searching the bin edges with np.histogram2d
+    cols = np.asarray(cols, dtype=np.int64)
+    rows = np.asarray(rows, dtype=np.int64)
+    sel = (cols >= 1) & (cols <= ncols) & (rows >= 1) & (rows <= nrows)
+    hist = np.bincount((rows[sel] - 1) * ncols + (cols[sel] - 1), minlength=nrows * ncols).reshape(nrows, ncols).astype(np.float64)
     return np.ma.masked_equal(hist, 0)
 
 
@@ -446,14 +450,17 @@ def plot_scurves(occupancy_hist, scan_parameters, title='S-curves', ylabel='Occu
     else:
         x_bins = np.arange(-0.5, max(scan_parameters) + 1.5)
     y_bins = np.arange(-0.5, max_occ + 1.5)
+    xedges = np.asarray(x_bins, dtype=np.float64)
+    yedges = np.asarray(y_bins, dtype=np.float64)
 
+    # all entries of one occupancy plane share the same scan parameter and thus the same x bin, a 1D histogram per column is sufficient
+    hist = np.zeros(shape=(yedges.shape[0] - 1, xedges.shape[0] - 1), dtype=np.float64)
     for index, scan_parameter in enumerate(scan_parameters):
-        compressed_data = np.ma.masked_array(occupancy_hist[:, :, index], mask=occ_mask, copy=True).compressed()
-        tmp_hist, yedges, xedges = np.histogram2d(compressed_data, [scan_parameter] * compressed_data.shape[0], bins=(y_bins, x_bins))
-        if index == 0:
-            hist = tmp_hist
-        else:
-            hist += tmp_hist
+        if scan_parameter < xedges[0] or scan_parameter > xedges[-1]:
+            continue
+        x_index = min(np.searchsorted(xedges, scan_parameter, side='right') - 1, hist.shape[1] - 1)  # last bin includes right edge
+        compressed_data = np.ma.masked_array(occupancy_hist[:, :, index], mask=occ_mask).compressed()  # compressed() returns a copy already
+        hist[:, x_index] += np.histogram(compressed_data, bins=hist.shape[0], range=(yedges[0], yedges[-1]))[0]
 
     fig = Figure()
     FigureCanvas(fig)
@@ -472,7 +479,7 @@ def plot_scurves(occupancy_hist, scan_parameters, title='S-curves', ylabel='Occu
         bounds = np.linspace(start=1.0, stop=z_max, num=255, endpoint=True)
         norm = colors.LogNorm()
     X, Y = np.meshgrid(xedges, yedges)
-    im = ax.pcolormesh(X, Y, np.ma.masked_where(hist == 0, hist), cmap=cmap, norm=norm)
+    im = ax.pcolormesh(X, Y, np.ma.masked_where(hist == 0, hist), cmap=cmap, norm=norm, rasterized=True)  # rasterize the mesh, otherwise every bin is written as a vector path into the PDF
     ax.axis([xedges[0], xedges[-1], yedges[0], yedges[-1]])
     if min_x is not None or max_x is not None:
         ax.set_xlim((min_x if min_x is not None else np.min(scan_parameters), max_x if max_x is not None else np.max(scan_parameters)))
@@ -617,7 +624,8 @@ def plot_three_way(hist, title, filename=None, x_axis_title=None, minimum=None,
     # cmap = matplotlib.cm.jet
     # cmap.set_bad('w',1.0)
     # ax.imshow(masked_array, interpolation='none', cmap=cmap)
-    hist = np.ma.masked_invalid(hist)
+    hist_data = np.ma.getdata(hist)
+    hist = np.ma.array(hist_data, mask=np.logical_or(np.ma.getmaskarray(hist), ~np.isfinite(hist_data)), copy=False)  # mask invalid values without copying the data or changing the mask of the input
     if minimum is None:
         minimum = 0.0
     elif minimum == 'minimum':
@@ -674,12 +682,13 @@ def create_2d_pixel_hist(fig, ax, hist2d, title=None, x_axis_title=None, y_axis_
 def create_1d_hist(ax, hist, title=None, x_axis_title=None, y_axis_title=None, bins=101, x_min=None, x_max=None):
     if x_min is None:
         x_min = 0.0
-    if hist.all() is np.ma.masked or np.allclose(0, hist) or (hist.shape[0] * hist.shape[1] - np.ma.count_masked(hist)) < 2:
+    is_empty_hist = hist.all() is np.ma.masked or np.allclose(0, hist)  # check if masked array is fully masked or has zeros everywhere
+    if is_empty_hist or (hist.shape[0] * hist.shape[1] - np.ma.count_masked(hist)) < 2:
         do_fit = False
     else:
         do_fit = True
     if x_max is None:
-        if hist.all() is np.ma.masked or np.allclose(0, hist):  # check if masked array is fully masked or has zeros everywhere
+        if is_empty_hist:
             x_max = 1.0
         else:
             x_max = max(1, hist.max())
@@ -702,7 +711,7 @@ def create_1d_hist(ax, hist, title=None, x_axis_title=None, y_axis_title=None, b
         _, _, _ = ax.hist(x=masked_hist_compressed, bins=hist_bins, range=hist_range, align='mid')  # re-bin to 1d histogram, x argument needs to be 1D
     # BUG: np.ma.compressed(np.ma.masked_array(hist, copy=True)) (2D) is not equal to np.ma.masked_array(hist, copy=True).compressed() (1D) if hist is ndarray
     ax.set_xlim(hist_range)  # overwrite xlim
-    if hist.all() is np.ma.masked or np.allclose(0, hist):
+    if is_empty_hist:
         ax.set_ylim((0, 1))
         ax.set_xlim((-0.5, +0.5))
     elif masked_hist_compressed.size == 0:  # or np.allclose(hist, 0.0):
@@ -767,7 +776,7 @@ def create_1d_hist(ax, hist, title=None, x_axis_title=None, y_axis_title=None, b
 
 def create_pixel_scatter_plot(ax, hist, title=None, x_axis_title=None, y_axis_title=None, y_min=None, y_max=None):
     scatter_y_mean = np.ma.mean(hist, axis=0)
-    scatter_y = hist.flatten('F')
+    scatter_y = hist.ravel(order='F')  # no copy for column-major input, e.g. histograms with swapped axes
     if not scatter_y_mean.all() is np.ma.masked and not scatter_y.all() is np.ma.masked:
         ax.scatter(range(80 * 336), scatter_y, marker='o', s=0.8, rasterized=True)
         p1, = ax.plot(range(336 // 2, 80 * 336 + 336 // 2, 336), scatter_y_mean, 'o')
@@ -1,93 +1,131 @@
 from collections import OrderedDict
-
-from basil.utils.BitLogic import BitLogic
+from numbers import Integral
 
 from pybar.daq.readout_utils import is_data_header, is_address_record, is_value_record, is_service_record, is_data_record
 
 flavors = ('fei4a', 'fei4b')
 
+# bit fields (name, msb, lsb) for each record layout
+_fields = {
+    'TW_0': (('trigger number', 30, 0),),
+    'TW_1': (('trigger timestamp', 30, 0),),
+    'TW_2': (('trigger timestamp', 30, 16), ('trigger number', 15, 0)),
+    'TDC_DIST': (('tdc distance', 27, 20), ('tdc counter', 19, 12), ('tdc value', 11, 0)),
+    'TDC': (('tdc counter', 27, 12), ('tdc value', 11, 0)),
+    'DH_fei4a': (('channel', 27, 24), ('start', 23, 19), ('header', 18, 16), ('flag', 15, 15), ('lvl1id', 14, 8), ('bcid', 7, 0)),
+    'DH_fei4b': (('channel', 27, 24), ('start', 23, 19), ('header', 18, 16), ('flag', 15, 15), ('lvl1id', 14, 10), ('bcid', 9, 0)),
+    'AR': (('channel', 27, 24), ('start', 23, 19), ('header', 18, 16), ('type', 15, 15), ('address', 14, 0)),
+    'VR': (('channel', 27, 24), ('start', 23, 19), ('header', 18, 16), ('value', 15, 0)),
+    'SR': (('channel', 27, 24), ('start', 23, 19), ('header', 18, 16), ('code', 15, 10), ('counter', 9, 0)),
+    'SR_14': (('channel', 27, 24), ('start', 23, 19), ('header', 18, 16), ('code', 15, 10), ('lvl1id[11:5]', 9, 3), ('bcid[12:10]', 2, 0)),
+    'SR_15': (('channel', 27, 24), ('start', 23, 19), ('header', 18, 16), ('code', 15, 10), ('skipped', 9, 0)),
+    'SR_16': (('channel', 27, 24), ('start', 23, 19), ('header', 18, 16), ('code', 15, 10), ('truncation flag', 9, 9), ('truncation counter', 8, 4), ('l1req', 3, 0)),
+    'DR': (('channel', 27, 24), ('column', 23, 17), ('row', 16, 8), ('tot1', 7, 4), ('tot2', 3, 0)),
+    'UNKNOWN_FE': (('channel', 27, 24), ('word', 31, 0)),
+    'UNKNOWN': (('unknown', 31, 0),)
+}
+
+
+def _make_decoder(fields):
+    '''Generate a function with hard-coded shifts and masks which returns the values of the given bit fields of a data word.
+    '''
+    code = 'def decode(word):\n    return (%s,)\n' % ', '.join('(word >> %d) & 0x%X' % (lsb, (1 << (msb - lsb + 1)) - 1) for _, msb, lsb in fields)
+    namespace = {}
+    exec(code, namespace)
+    return namespace['decode']
+
+
+_field_names = dict((layout, tuple(name for name, _, _ in fields)) for layout, fields in _fields.items())
+_decoders = dict((layout, _make_decoder(fields)) for layout, fields in _fields.items())
+
 
 class FEI4Record(object):
     """Record Object
 
     """
+    # output format for each record layout, values are filled in the order of record_dict
+    _FMT = {
+        'TW_0': 'TW trigger number:{}',
+        'TW_1': 'TW trigger timestamp:{}',
+        'TW_2': 'TW trigger timestamp:{} trigger number:{}',
+        'TDC_DIST': 'TDC tdc distance:{} tdc counter:{} tdc value:{}',
+        'TDC': 'TDC tdc counter:{} tdc value:{}',
+        'DH_fei4a': 'DH channel:{} start:{} header:{} flag:{} lvl1id:{} bcid:{}',
+        'DH_fei4b': 'DH channel:{} start:{} header:{} flag:{} lvl1id:{} bcid:{}',
+        'AR': 'AR channel:{} start:{} header:{} type:{} address:{}',
+        'VR': 'VR channel:{} start:{} header:{} value:{}',
+        'SR': 'SR channel:{} start:{} header:{} code:{} counter:{}',
+        'SR_14': 'SR channel:{} start:{} header:{} code:{} lvl1id[11:5]:{} bcid[12:10]:{}',
+        'SR_15': 'SR channel:{} start:{} header:{} code:{} skipped:{}',
+        'SR_16': 'SR channel:{} start:{} header:{} code:{} truncation flag:{} truncation counter:{} l1req:{}',
+        'DR': 'DR channel:{} column:{} row:{} tot1:{} tot2:{}',
+        'UNKNOWN_FE': 'UNKNOWN FE WORD channel:{} word:{}',
+        'UNKNOWN': 'UNKNOWN WORD unknown:{}'
+    }
+
     def __init__(self, data_word, chip_flavor, tdc_trig_dist=False, trigger_data_mode=0):
         self.record_rawdata = int(data_word)
-        self.record_word = BitLogic.from_value(value=self.record_rawdata, size=32)
-        self.record_dict = OrderedDict()
         if self.record_rawdata & 0x80000000:
             self.record_type = "TW"
-            if trigger_data_mode == 0:
-                self.record_dict.update([('trigger number', self.record_word[30:0].tovalue())])
-            elif trigger_data_mode == 1:
-                self.record_dict.update([('trigger timestamp', self.record_word[30:0].tovalue())])
-            elif trigger_data_mode == 2:
-                self.record_dict.update([('trigger timestamp', self.record_word[30:16].tovalue()), ('trigger number', self.record_word[15:0].tovalue())])
-            else:
+            if trigger_data_mode not in (0, 1, 2):
                 raise ValueError("Unknown trigger data mode %d" % trigger_data_mode)
-        elif self.record_rawdata & 0xF0000000 == 0x40000000:
+            self._layout = 'TW_%d' % trigger_data_mode
+        elif (self.record_rawdata & 0xF0000000) == 0x40000000:
             self.record_type = "TDC"
-            if tdc_trig_dist:
-                self.record_dict.update([('tdc distance', self.record_word[27:20].tovalue()), ('tdc counter', self.record_word[19:12].tovalue()), ('tdc value', self.record_word[11:0].tovalue())])
-            else:
-                self.record_dict.update([('tdc counter', self.record_word[27:12].tovalue()), ('tdc value', self.record_word[11:0].tovalue())])
+            self._layout = 'TDC_DIST' if tdc_trig_dist else 'TDC'
         elif not self.record_rawdata & 0xF0000000:  # FE data
-            self.record_dict.update([('channel', (self.record_rawdata & 0x0F000000) >> 24)])
             self.chip_flavor = chip_flavor
             if self.chip_flavor not in flavors:
-                raise KeyError('Chip flavor is not of type {}'.format(', '.join('\'' + flav + '\'' for flav in self.chip_flavors)))
+                raise KeyError('Chip flavor is not of type {}'.format(', '.join('\'' + flav + '\'' for flav in flavors)))
             if is_data_header(self.record_rawdata):
                 self.record_type = "DH"
-                if self.chip_flavor == "fei4a":
-                    self.record_dict.update([('start', self.record_word[23:19].tovalue()), ('header', self.record_word[18:16].tovalue()), ('flag', self.record_word[15:15].tovalue()), ('lvl1id', self.record_word[14:8].tovalue()), ('bcid', self.record_word[7:0].tovalue())])
-                elif self.chip_flavor == "fei4b":
-                    self.record_dict.update([('start', self.record_word[23:19].tovalue()), ('header', self.record_word[18:16].tovalue()), ('flag', self.record_word[15:15].tovalue()), ('lvl1id', self.record_word[14:10].tovalue()), ('bcid', self.record_word[9:0].tovalue())])
+                self._layout = 'DH_' + self.chip_flavor
             elif is_address_record(self.record_rawdata):
                 self.record_type = "AR"
-                self.record_dict.update([('start', self.record_word[23:19].tovalue()), ('header', self.record_word[18:16].tovalue()), ('type', self.record_word[15:15].tovalue()), ('address', self.record_word[14:0].tovalue())])
+                self._layout = 'AR'
             elif is_value_record(self.record_rawdata):
                 self.record_type = "VR"
-                self.record_dict.update([('start', self.record_word[23:19].tovalue()), ('header', self.record_word[18:16].tovalue()), ('value', self.record_word[15:0].tovalue())])
+                self._layout = 'VR'
             elif is_service_record(self.record_rawdata):
                 self.record_type = "SR"
-                if self.chip_flavor == "fei4a":
-                    self.record_dict.update([('start', self.record_word[23:19].tovalue()), ('header', self.record_word[18:16].tovalue()), ('code', self.record_word[15:10].tovalue()), ('counter', self.record_word[9:0].tovalue())])
-                elif self.chip_flavor == "fei4b":
-                    if self.record_word[15:10].tovalue() == 14:
-                        self.record_dict.update([('start', self.record_word[23:19].tovalue()), ('header', self.record_word[18:16].tovalue()), ('code', self.record_word[15:10].tovalue()), ('lvl1id[11:5]', self.record_word[9:3].tovalue()), ('bcid[12:10]', self.record_word[2:0].tovalue())])
-                    elif self.record_word[15:10].tovalue() == 15:
-                        self.record_dict.update([('start', self.record_word[23:19].tovalue()), ('header', self.record_word[18:16].tovalue()), ('code', self.record_word[15:10].tovalue()), ('skipped', self.record_word[9:0].tovalue())])
-                    elif self.record_word[15:10].tovalue() == 16:
-                        self.record_dict.update([('start', self.record_word[23:19].tovalue()), ('header', self.record_word[18:16].tovalue()), ('code', self.record_word[15:10].tovalue()), ('truncation flag', self.record_word[9:9].tovalue()), ('truncation counter', self.record_word[8:4].tovalue()), ('l1req', self.record_word[3:0].tovalue())])
-                    else:
-                        self.record_dict.update([('start', self.record_word[23:19].tovalue()), ('header', self.record_word[18:16].tovalue()), ('code', self.record_word[15:10].tovalue()), ('counter', self.record_word[9:0].tovalue())])
+                code = (self.record_rawdata & 0x0000FC00) >> 10
+                if self.chip_flavor == "fei4b" and code in (14, 15, 16):
+                    self._layout = 'SR_%d' % code
+                else:
+                    self._layout = 'SR'
             elif is_data_record(self.record_rawdata):
                 self.record_type = "DR"
-                self.record_dict.update([('column', self.record_word[23:17].tovalue()), ('row', self.record_word[16:8].tovalue()), ('tot1', self.record_word[7:4].tovalue()), ('tot2', self.record_word[3:0].tovalue())])
+                self._layout = 'DR'
             else:
                 self.record_type = "UNKNOWN FE WORD"
-                self.record_dict.update([('word', self.record_word.tovalue())])
-    #             raise ValueError('Unknown data word: ' + str(self.record_word.tovalue()))
+                self._layout = 'UNKNOWN_FE'
         else:
             self.record_type = "UNKNOWN WORD"
-            self.record_dict.update([('unknown', self.record_word[31:0].tovalue())])
+            self._layout = 'UNKNOWN'
+        self.record_dict = OrderedDict(zip(_field_names[self._layout], _decoders[self._layout](self.record_rawdata)))
+
+    @classmethod
+    def from_row(cls, rec_array, index, chip_flavor, tdc_trig_dist=False, trigger_data_mode=0):
+        '''Create record from an entry of the array returned by readout_utils.decode_to_recarray().
+        '''
+        return cls(rec_array['raw'][index], chip_flavor=chip_flavor, tdc_trig_dist=tdc_trig_dist, trigger_data_mode=trigger_data_mode)
 
     def __len__(self):
         return len(self.record_dict)
 
     def __getitem__(self, key):
-        if not (isinstance(key, (int, long)) or isinstance(key, basestring)):
-            raise TypeError()
-        try:
+        if isinstance(key, basestring):
             return self.record_dict[key.lower()]
-        except TypeError:
-            return self.record_dict[self.record_dict.iterkeys()[int(key)]]
+        elif isinstance(key, Integral):
+            return list(self.record_dict.values())[key]
+        else:
+            raise TypeError()
 
     def next(self):
-        return self.record_dict.iteritems().next()
+        return next(iter(self.record_dict.items()))
 
     def __iter__(self):
-        return self.record_dict.iteritems()
+        return iter(self.record_dict.items())
 
     def __eq__(self, other):
         try:
@@ -99,7 +137,7 @@ class FEI4Record(object):
                 return False
 
     def __str__(self):
-        return self.record_type + ' {}'.format(' '.join(key + ':' + str(val) for key, val in self.record_dict.iteritems()))
+        return self._FMT[self._layout].format(*self.record_dict.values())
 
     def __repr__(self):
         return repr(self.__str__())
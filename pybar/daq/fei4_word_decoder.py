@@ -0,0 +1,39 @@
+''' Decoding of raw data words without NumPy. Fallback for hosts where NumPy is not available, see readout_utils for the NumPy implementation.
+'''
+import struct
+
+
+# record type codes of the decoded records, index corresponds to the type code
+record_types = ('UNKNOWN WORD', 'TW', 'TDC', 'DH', 'AR', 'VR', 'SR', 'DR', 'UNKNOWN FE WORD')
+
+# record type lookup tables, indexed by bits 28-31 of any word and by bits 16-23 of FE words
+record_type_lut = (8, 0, 0, 0, 2, 0, 0, 0, 1, 1, 1, 1, 1, 1, 1, 1)  # FE word (0), TDC word (4), trigger word (8 - 15), unknown word otherwise
+fe_record_type_lut = tuple(7 if 0x02 <= fe_byte <= 0xA1 else {0xE9: 3, 0xEA: 4, 0xEC: 5, 0xEF: 6}.get(fe_byte, 8) for fe_byte in range(256))  # DR for column 1 - 80 (row is checked separately), DH, AR, VR, SR, unknown FE word otherwise
+
+
+def decode_words_pure(buf):
+    '''Decode raw data buffer without NumPy, e.g. for the raw bytes received from the FIFO.
+
+    Parameters
+    ----------
+    buf : bytes
+        Raw data buffer, little-endian 32-bit words.
+
+    Returns
+    -------
+    List of tuples (type, col, row, tot1, tot2) with the same content as readout_utils.decode_to_recarray().
+    '''
+    records = []
+    dr = record_types.index('DR')
+    unknown_fe_word = record_types.index('UNKNOWN FE WORD')
+    for word in struct.unpack_from('<%dI' % (len(buf) // 4), buf):
+        if word & 0xF0000000:
+            records.append((record_type_lut[word >> 28], 0, 0, 0, 0))
+            continue
+        record_type = fe_record_type_lut[(word >> 16) & 0xFF]
+        row = (word & 0x0001FF00) >> 8
+        if record_type == dr and 0 < row <= 336:
+            records.append((dr, (word & 0x00FE0000) >> 17, row, (word & 0x000000F0) >> 4, word & 0x0000000F))
+        else:
+            records.append((unknown_fe_word if record_type == dr else record_type, 0, 0, 0, 0))
+    return records
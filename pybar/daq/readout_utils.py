@@ -4,6 +4,8 @@ import os
 import numpy as np
 import tables as tb
 
+from pybar.daq.fei4_word_decoder import record_types, record_type_lut, fe_record_type_lut
+
 
 class NameValue(tb.IsDescription):
     name = tb.StringCol(256, pos=0)
@@ -417,6 +419,109 @@ def get_tot_iterator_from_data_records(array):  # generator
             yield np.bitwise_and(item, 0x0000000F)  # ToT2
 
 
+record_dtype = np.dtype([('type', np.uint8), ('col', np.uint8), ('row', np.uint16), ('tot1', np.uint8), ('tot2', np.uint8), ('raw', np.uint32)])
+
+
+# record type lookup tables as arrays for np.take(), see fei4_word_decoder
+_record_type_lut = np.array(record_type_lut, dtype=np.uint8)
+_fe_record_type_lut = np.array(fe_record_type_lut, dtype=np.uint8)
+
+
+def decode_and_filter(array, mask_out, type_out, col_out, row_out, tot1_out, tot2_out, record_type='DR'):
+    '''Classify and decode raw data array and select records of given type. The results are written into the given output arrays.
+
+    Parameters
+    ----------
+    array : numpy.array
+        Raw data array.
+    mask_out : numpy.array
+        Boolean array, true for each word of the selected record type.
+    type_out : numpy.array
+        Record type code array (index in record_types).
+    col_out, row_out, tot1_out, tot2_out : numpy.array
+        Column, row, ToT1 and ToT2 array. Only set for data records, 0 otherwise.
+    record_type : string
+        Record type to select, one of record_types.
+
+    Returns
+    -------
+    mask_out : numpy.array
+
+    Usage:
+        decode_and_filter(raw_data, mask, type_code, col, row, tot1, tot2)
+        col_data_records = col[mask]
+    '''
+    np.take(_record_type_lut, np.right_shift(array, 28), out=type_out)
+    fe_byte = np.bitwise_and(np.right_shift(array, 16), 0xFF)
+    np.copyto(type_out, np.take(_fe_record_type_lut, fe_byte), where=is_fe_word(array))
+    np.right_shift(fe_byte, 1, out=col_out, casting='unsafe')
+    np.right_shift(np.bitwise_and(array, 0x0001FF00), 8, out=row_out, casting='unsafe')
+    np.right_shift(np.bitwise_and(array, 0x000000F0), 4, out=tot1_out, casting='unsafe')
+    np.bitwise_and(array, 0x0000000F, out=tot2_out, casting='unsafe')
+    data_record = np.equal(type_out, record_types.index('DR'))
+    # row 1 - 336
+    type_out[np.logical_and(data_record, np.logical_or(np.equal(row_out, 0), np.greater(row_out, 336)))] = record_types.index('UNKNOWN FE WORD')
+    np.equal(type_out, record_types.index('DR'), out=data_record)
+    for field_out in (col_out, row_out, tot1_out, tot2_out):
+        np.multiply(field_out, data_record, out=field_out, casting='unsafe')
+    np.equal(type_out, record_types.index(record_type), out=mask_out)
+    return mask_out
+
+
+def decode_to_recarray(array):
+    '''Decode raw data array into a structured array with one entry per raw data word.
+
+    Parameters
+    ----------
+    array : numpy.array
+        Raw data array.
+
+    Returns
+    -------
+    numpy.array with dtype record_dtype. The field 'type' is the index of the record type in record_types, 'col', 'row', 'tot1' and 'tot2' are only set for data records. The field 'raw' keeps the raw data word.
+    '''
+    array = np.asarray(array, dtype=np.uint32)
+    rec_array = np.empty(array.shape[0], dtype=record_dtype)
+    rec_array['raw'] = array
+    decode_and_filter(array, mask_out=np.empty(array.shape[0], dtype=np.bool_), type_out=rec_array['type'], col_out=rec_array['col'], row_out=rec_array['row'], tot1_out=rec_array['tot1'], tot2_out=rec_array['tot2'])
+    return rec_array
+
+
+class FEI4Decoder(object):
+    '''Raw data decoder which keeps its output arrays between calls. Use one instance for all readouts to avoid allocating new arrays for every raw data chunk.
+
+    Parameters
+    ----------
+    capacity : int
+        Initial size of the output arrays, e.g. the maximum number of words per readout. The arrays are enlarged if necessary.
+    '''
+    def __init__(self, capacity):
+        self._allocate(capacity)
+
+    def _allocate(self, capacity):
+        self.capacity = capacity
+        self.mask = np.empty(capacity, dtype=np.bool_)
+        self.type = np.empty(capacity, dtype=np.uint8)
+        self.col = np.empty(capacity, dtype=np.uint8)
+        self.row = np.empty(capacity, dtype=np.uint16)
+        self.tot1 = np.empty(capacity, dtype=np.uint8)
+        self.tot2 = np.empty(capacity, dtype=np.uint8)
+
+    def decode(self, array, record_type='DR'):
+        '''Decode raw data array, see decode_and_filter().
+
+        Returns
+        -------
+        Tuple of arrays (mask, type, col, row, tot1, tot2). The arrays are views into the buffers of the decoder and are overwritten by the next call.
+        '''
+        n_words = array.shape[0]
+        if n_words > self.capacity:
+            self._allocate(n_words)
+        outputs = (self.mask[:n_words], self.type[:n_words], self.col[:n_words], self.row[:n_words], self.tot1[:n_words], self.tot2[:n_words])
+        decode_and_filter(array, *outputs, record_type=record_type)
+        return outputs
+
+
 def build_events_from_raw_data(array):
     idx = np.where(is_trigger_word(array))[-1]
     if idx.shape[0] == 0:
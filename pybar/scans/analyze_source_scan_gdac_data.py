@@ -86,14 +86,15 @@ def plot_result(x_p, y_p, y_p_e, smoothed_data, smoothed_data_diff, filename=Non
     logging.info('Plot results')
     plt.close()
 
-    p1 = plt.errorbar(x_p * analysis_configuration['vcal_calibration'], y_p, yerr=y_p_e, fmt='o')  # plot data with error bars
-    p2, = plt.plot(x_p * analysis_configuration['vcal_calibration'], smoothed_data, '-r')  # plot smoothed data
+    x_charge = x_p * analysis_configuration['vcal_calibration']  # PlsrDAC to electrons
+    p1 = plt.errorbar(x_charge, y_p, yerr=y_p_e, fmt='o')  # plot data with error bars
+    p2, = plt.plot(x_charge, smoothed_data, '-r')  # plot smoothed data
     factor = np.amax(y_p) / np.amin(smoothed_data_diff) * 1.1
-    p3, = plt.plot(x_p * analysis_configuration['vcal_calibration'], factor * smoothed_data_diff, '-', lw=2)  # plot differentiated data
-    mpv_index = np.argmax(-analysis_utils.smooth_differentiation(x_p, y_p, weigths=1 / y_p_e, order=3, smoothness=analysis_configuration['smoothness'], derivation=1))
-    p4, = plt.plot([x_p[mpv_index] * analysis_configuration['vcal_calibration'], x_p[mpv_index] * analysis_configuration['vcal_calibration']], [0, factor * smoothed_data_diff[mpv_index]], 'k-', lw=2)
-    text = 'MPV ' + str(int(x_p[mpv_index] * analysis_configuration['vcal_calibration'])) + ' e'
-    plt.text(1.01 * x_p[mpv_index] * analysis_configuration['vcal_calibration'], -10. * smoothed_data_diff[mpv_index], text, ha='left')
+    p3, = plt.plot(x_charge, factor * smoothed_data_diff, '-', lw=2)  # plot differentiated data
+    mpv_index = np.argmax(-smoothed_data_diff)  # smoothed_data_diff is the spline differentiation of the data, no need to fit again
+    p4, = plt.plot([x_charge[mpv_index], x_charge[mpv_index]], [0, factor * smoothed_data_diff[mpv_index]], 'k-', lw=2)
+    text = 'MPV ' + str(int(x_charge[mpv_index])) + ' e'
+    plt.text(1.01 * x_charge[mpv_index], -10. * smoothed_data_diff[mpv_index], text, ha='left')
     plt.legend([p1, p2, p3, p4], ['data', 'smoothed spline', 'spline differentiation', text], prop={'size': 12}, loc=0)
     plt.title('\'Single hit cluster\'-occupancy for different pixel thresholds')
     plt.xlabel('Pixel threshold [e]')
@@ -157,7 +158,6 @@ def analyze_injected_charge(data_analyzed_file):
             if analysis_configuration['input_file_calibration']:
                 with tb.open_file(analysis_configuration['input_file_calibration'], mode="r") as in_file_calibration_h5:  # read calibration file from calibrate_threshold_gdac scan
                     mean_threshold_calibration = in_file_calibration_h5.root.MeanThresholdCalibration[:]
-                    threshold_calibration_array = in_file_calibration_h5.root.HistThresholdCalibration[:]
 
                     gdac_range_calibration = np.array(in_file_calibration_h5.root.HistThresholdCalibration._v_attrs.scan_parameter_values)
                     gdac_range_source_scan = gdacs
@@ -168,10 +168,12 @@ def analyze_injected_charge(data_analyzed_file):
                     occupancy = occupancy[:, :, sel]
                     sel = np.where(np.logical_and(gdac_range_calibration >= analysis_configuration['min_gdac'], gdac_range_calibration <= analysis_configuration['max_gdac']))[0]
                     gdac_range_calibration = gdac_range_calibration[sel]
-                    threshold_calibration_array = threshold_calibration_array[:, :, sel]
+                    threshold_calibration_array = in_file_calibration_h5.root.HistThresholdCalibration[:, :, sel]  # read only the calibration at the selected GDACs
 
-                    logging.info('Analyzing source scan data with %d GDAC settings from %d to %d with minimum step sizes from %d to %d', len(gdac_range_source_scan), np.min(gdac_range_source_scan), np.max(gdac_range_source_scan), np.min(np.gradient(gdac_range_source_scan)), np.max(np.gradient(gdac_range_source_scan)))
-                    logging.info('Use calibration data with %d GDAC settings from %d to %d with minimum step sizes from %d to %d', len(gdac_range_calibration), np.min(gdac_range_calibration), np.max(gdac_range_calibration), np.min(np.gradient(gdac_range_calibration)), np.max(np.gradient(gdac_range_calibration)))
+                    gdac_steps_source_scan = np.gradient(gdac_range_source_scan)
+                    gdac_steps_calibration = np.gradient(gdac_range_calibration)
+                    logging.info('Analyzing source scan data with %d GDAC settings from %d to %d with minimum step sizes from %d to %d', len(gdac_range_source_scan), np.min(gdac_range_source_scan), np.max(gdac_range_source_scan), np.min(gdac_steps_source_scan), np.max(gdac_steps_source_scan))
+                    logging.info('Use calibration data with %d GDAC settings from %d to %d with minimum step sizes from %d to %d', len(gdac_range_calibration), np.min(gdac_range_calibration), np.max(gdac_range_calibration), np.min(gdac_steps_calibration), np.max(gdac_steps_calibration))
 
                     # rate_normalization of the total hit number for each GDAC setting
                     rate_normalization = 1.
@@ -188,8 +190,11 @@ def analyze_injected_charge(data_analyzed_file):
                             plot_cluster_sizes(correction_h5, in_file_calibration_h5, gdac_range=gdac_range_source_scan)
 
                     pixel_thresholds = analysis_utils.get_pixel_thresholds_from_calibration_array(gdacs=gdac_range_source_scan, calibration_gdacs=gdac_range_calibration, threshold_calibration_array=threshold_calibration_array)  # interpolates the threshold at the source scan GDAC setting from the calibration
-                    pixel_hits = occupancy  # create hit array with shape (col, row, ...)
-                    pixel_hits = pixel_hits * correction_factors * rate_normalization
+                    pixel_hits = occupancy.astype(np.float32, order='C')  # create hit array with shape (col, row, ...), the profile histogram uses single precision anyway; C order resolves the transposed HistOcc layout in the same copy
+                    if analysis_configuration['use_cluster_rate_correction']:
+                        pixel_hits *= correction_factors
+                    if analysis_configuration['normalize_rate']:
+                        pixel_hits *= rate_normalization
 
                     # choose region with pixels that have a sufficient occupancy but are not too hot
                     good_pixel = analysis_utils.select_good_pixel_region(pixel_hits, col_span=analysis_configuration['col_span'], row_span=analysis_configuration['row_span'], min_cut_threshold=analysis_configuration['min_cut_threshold'], max_cut_threshold=analysis_configuration['max_cut_threshold'])
@@ -198,12 +203,12 @@ def analyze_injected_charge(data_analyzed_file):
                     selected_pixel_thresholds = pixel_thresholds[pixel_mask, :]  # reduce the data to pixels that are in the good pixel region
                     plotting.plot_occupancy(good_pixel.T, title='Selected pixel for analysis (' + str(len(selected_pixel_hits)) + ')', filename=plot_file)
 
-                    # reshape to one dimension
-                    x = selected_pixel_thresholds.flatten()
-                    y = selected_pixel_hits.flatten()
+                    # reshape to one dimension, the boolean selection above already returns contiguous copies
+                    x = selected_pixel_thresholds.ravel()
+                    y = selected_pixel_hits.ravel()
 
                     # nothing should be NAN/INF, NAN/INF is not supported yet
-                    if np.isfinite(x).shape != x.shape or np.isfinite(y).shape != y.shape:
+                    if not np.isfinite(x).all() or not np.isfinite(y).all():
                         logging.warning('There are pixels with NaN or INF threshold or hit values, analysis will fail')
 
                     # calculated profile histogram
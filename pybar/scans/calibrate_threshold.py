@@ -58,10 +58,10 @@ def create_threshold_calibration(scan_base_file_name, create_plots=True):  # Cre
 
     def store_calibration_data_as_array(out_file_h5, mean_threshold_calibration, mean_threshold_rms_calibration, threshold_calibration, parameter_name, parameter_values):
         logging.info("Storing calibration data in an array...")
-        filter_table = tb.Filters(complib='blosc', complevel=5, fletcher32=False)
+        filter_table = tb.Filters(complib='blosc:lz4', complevel=5, shuffle=False, bitshuffle=True, fletcher32=False)
         mean_threshold_calib_array = out_file_h5.create_carray(out_file_h5.root, name='HistThresholdMeanCalibration', atom=tb.Atom.from_dtype(mean_threshold_calibration.dtype), shape=mean_threshold_calibration.shape, title='mean_threshold_calibration', filters=filter_table)
         mean_threshold_calib_rms_array = out_file_h5.create_carray(out_file_h5.root, name='HistThresholdRMSCalibration', atom=tb.Atom.from_dtype(mean_threshold_calibration.dtype), shape=mean_threshold_calibration.shape, title='mean_threshold_rms_calibration', filters=filter_table)
-        threshold_calib_array = out_file_h5.create_carray(out_file_h5.root, name='HistThresholdCalibration', atom=tb.Atom.from_dtype(threshold_calibration.dtype), shape=threshold_calibration.shape, title='threshold_calibration', filters=filter_table)
+        threshold_calib_array = out_file_h5.create_carray(out_file_h5.root, name='HistThresholdCalibration', atom=tb.Atom.from_dtype(threshold_calibration.dtype), shape=threshold_calibration.shape, title='threshold_calibration', filters=filter_table, chunkshape=(threshold_calibration.shape[0], threshold_calibration.shape[1], 1))  # one chunk per scan parameter value
         mean_threshold_calib_array[:] = mean_threshold_calibration
         mean_threshold_calib_rms_array[:] = mean_threshold_rms_calibration
         threshold_calib_array[:] = threshold_calibration
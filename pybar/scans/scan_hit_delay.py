@@ -199,9 +199,9 @@ def analyze_hit_delay(raw_data_file):
             pixel_data_fixed = pixel_data_fixed.reshape(pixel_data.shape[0], pixel_data.shape[1], pixel_data.shape[2])  # Reshape after interpolation of Nans
 
             # Fit all BCID jumps per pixel (1 - 2 jumps expected) with multithreading
-            pixel_data_shaped = pixel_data_fixed.reshape(pixel_data_fixed.shape[0] * pixel_data_fixed.shape[1], pixel_data_fixed.shape[2]).tolist()
+            pixel_data_shaped = pixel_data_fixed.reshape(pixel_data_fixed.shape[0] * pixel_data_fixed.shape[1], pixel_data_fixed.shape[2])
             pool = mp.Pool()  # create as many workers as physical cores are available
-            result_array = np.array(pool.map(fit_bcid_jumps, pixel_data_shaped))
+            result_array = np.array(pool.map(fit_bcid_jumps, pixel_data_shaped, chunksize=max(1, pixel_data_shaped.shape[0] // (4 * mp.cpu_count()))))  # rows are sent as arrays, not as lists of Python floats
             pool.close()
             pool.join()
             result_array = result_array.reshape(pixel_data_fixed.shape[0], pixel_data_fixed.shape[1], 4)
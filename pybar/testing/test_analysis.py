@@ -6,6 +6,7 @@ import os
 import progressbar
 import tables as tb
 import numpy as np
+from scipy.special import erf
 
 from pixel_clusterizer.clusterizer import HitClusterizer
 
@@ -14,10 +15,12 @@ from pybar_fei4_interpreter.data_histograming import PyDataHistograming
 from pybar_fei4_interpreter import analysis_utils as fast_analysis_utils
 from pybar_fei4_interpreter import data_struct
 
-from pybar.analysis.analyze_raw_data import AnalyzeRawData
+from pybar.analysis.analyze_raw_data import AnalyzeRawData, fit_scurve, fit_scurves_batched, fit_scurves_chunk, get_scurve_start_values
 from pybar.testing.tools import test_tools
 from pybar.scans.calibrate_hit_or import create_hitor_calibration
-from pybar.daq.readout_utils import get_col_row_array_from_data_record_array, convert_data_array, is_data_record
+from pybar.daq.readout_utils import get_col_row_array_from_data_record_array, convert_data_array, is_data_record, decode_to_recarray, record_types, decode_and_filter, get_col_row_tot_array_from_data_record_array, is_trigger_word, is_fe_word, is_data_header, is_address_record, is_value_record, is_service_record, FEI4Decoder
+from pybar.daq.fei4_record import FEI4Record
+from pybar.daq.fei4_word_decoder import decode_words_pure
 from pybar.analysis.analysis_utils import data_aligned_at_events, InvalidInputError
 import pybar.scans.analyze_source_scan_tdc_data as tdc_analysis
 
@@ -223,6 +226,72 @@ class TestAnalysis(unittest.TestCase):
         occ_hist_python, _, _ = np.histogram2d(col_arr, row_arr, bins=(80, 336), range=[[1, 80], [1, 336]])
         self.assertTrue(np.all(occ_hist_cpp == occ_hist_python))
 
+    def test_decode_to_recarray(self):  # check decoded record array against FEI4Record
+        raw_data = np.concatenate([np.random.randint(0, 2 ** 24, 5000), np.random.randint(0, 2 ** 32, 1000, dtype=np.int64), [0x00030000, 0x00035100, 0x00A35101, 0x40000123, 0x10000000, 0x70000000, 0xF0000000]]).astype(np.uint32)  # FE words, any words, DR with row 0, row 337 and column 81, TDC and unknown words
+        rec_array = decode_to_recarray(raw_data)
+        self.assertTrue(np.all(rec_array['raw'] == raw_data))
+        for index, word in enumerate(raw_data):
+            record = FEI4Record(word, 'fei4b')
+            self.assertEqual(record_types[rec_array['type'][index]], record.record_type)
+            self.assertEqual(str(FEI4Record.from_row(rec_array, index, 'fei4b')), str(record))
+            if record.record_type == 'DR':
+                self.assertEqual((rec_array['col'][index], rec_array['row'][index], rec_array['tot1'][index], rec_array['tot2'][index]), (record['column'], record['row'], record['tot1'], record['tot2']))
+            else:
+                self.assertEqual((rec_array['col'][index], rec_array['row'][index], rec_array['tot1'][index], rec_array['tot2'][index]), (0, 0, 0, 0))
+
+    def test_decode_and_filter(self):  # check record type lookup tables and masked output against readout_utils filter functions
+        raw_data = np.concatenate([np.random.randint(0, 2 ** 24, 5000), np.random.randint(0, 2 ** 32, 1000, dtype=np.int64), [0x00030000, 0x00035100, 0x00A35101, 0x40000123, 0x10000000, 0x70000000, 0xF0000000]]).astype(np.uint32)
+        n_words = raw_data.shape[0]
+        mask, type_code = np.empty(n_words, dtype=np.bool_), np.empty(n_words, dtype=np.uint8)
+        col, row, tot1, tot2 = np.empty(n_words, dtype=np.uint8), np.empty(n_words, dtype=np.uint16), np.empty(n_words, dtype=np.uint8), np.empty(n_words, dtype=np.uint8)
+        decode_and_filter(raw_data, mask, type_code, col, row, tot1, tot2)
+        fe_word = is_fe_word(raw_data)
+        expected_types = {
+            'TW': is_trigger_word(raw_data),
+            'TDC': np.bitwise_and(raw_data, 0xF0000000) == 0x40000000,
+            'DH': np.logical_and(fe_word, is_data_header(raw_data)),
+            'AR': np.logical_and(fe_word, is_address_record(raw_data)),
+            'VR': np.logical_and(fe_word, is_value_record(raw_data)),
+            'SR': np.logical_and(fe_word, is_service_record(raw_data)),
+            'DR': np.logical_and(fe_word, is_data_record(raw_data))}
+        expected_types['UNKNOWN FE WORD'] = np.logical_and(fe_word, ~np.any([expected_types[record_type] for record_type in ('DH', 'AR', 'VR', 'SR', 'DR')], axis=0))
+        expected_types['UNKNOWN WORD'] = ~np.any(list(expected_types.values()), axis=0)
+        for record_type, expected in expected_types.items():
+            self.assertTrue(np.all((type_code == record_types.index(record_type)) == expected), record_type)
+        self.assertTrue(np.all(mask == expected_types['DR']))
+        # hits of the masked output in the same format as get_col_row_tot_array_from_data_record_array
+        hits = np.column_stack((np.repeat(col[mask], 2), np.column_stack((row[mask], row[mask] + 1)).ravel(), np.column_stack((tot1[mask], tot2[mask])).ravel()))
+        self.assertTrue(np.array_equal(hits[hits[:, 2] < 14], np.column_stack(get_col_row_tot_array_from_data_record_array(raw_data[mask]))))
+        for field in (col, row, tot1, tot2):
+            self.assertTrue(np.all(field[~mask] == 0))
+        decode_and_filter(raw_data, mask, type_code, col, row, tot1, tot2, record_type='SR')
+        self.assertTrue(np.all(mask == expected_types['SR']))
+
+    def test_fei4_decoder(self):  # check reuse of the output arrays for growing and shrinking raw data size
+        decoder = FEI4Decoder(100)
+        capacity = 100
+        for n_words in (10, 100, 1000, 500, 5000, 20, 0, 1000):
+            raw_data = np.random.randint(0, 2 ** 32, n_words, dtype=np.int64).astype(np.uint32)
+            raw_data[::2] &= 0x00FFFFFF  # FE words
+            rec_array = decode_to_recarray(raw_data)
+            mask, type_code, col, row, tot1, tot2 = decoder.decode(raw_data)
+            capacity = max(capacity, n_words)  # arrays are only enlarged
+            self.assertEqual(decoder.capacity, capacity)
+            for output in (mask, type_code, col, row, tot1, tot2):
+                self.assertEqual(output.shape[0], n_words)
+            self.assertTrue(np.all(mask == (rec_array['type'] == record_types.index('DR'))))
+            self.assertTrue(np.all(type_code == rec_array['type']))
+            self.assertTrue(np.all(col == rec_array['col']))
+            self.assertTrue(np.all(row == rec_array['row']))
+            self.assertTrue(np.all(tot1 == rec_array['tot1']))
+            self.assertTrue(np.all(tot2 == rec_array['tot2']))
+
+    def test_decode_words_pure(self):  # check NumPy-free decoder against decode_to_recarray
+        raw_data = np.concatenate([np.random.randint(0, 2 ** 24, 5000), np.random.randint(0, 2 ** 32, 1000, dtype=np.int64), [0x00030000, 0x00035100, 0x00A35101, 0x40000123, 0x10000000, 0x70000000, 0xF0000000]]).astype(np.uint32)
+        rec_array = decode_to_recarray(raw_data)
+        records = decode_words_pure(raw_data.astype('<u4').tobytes())
+        self.assertListEqual(records, rec_array[['type', 'col', 'row', 'tot1', 'tot2']].tolist())
+
     def test_analysis_utils_in1d_events(self):  # check compiled get_in1d_sorted function
         event_numbers = np.array([[0, 0, 2, 2, 2, 4, 5, 5, 6, 7, 7, 7, 8], [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]], dtype=np.int64)
         event_numbers_2 = np.array([1, 1, 1, 2, 2, 2, 4, 4, 4, 7], dtype=np.int64)
@@ -276,6 +345,37 @@ class TestAnalysis(unittest.TestCase):
                 pass
             self.assertTrue(exception_ok & np.all(array == array_fast))
 
+    def test_scurve_fit_batched(self):  # check vectorized S-curve fit against scipy curve_fit
+        np.random.seed(0)
+        plsr_dac = np.arange(0, 100, dtype=np.float64)
+        mu, sigma = np.random.uniform(20, 60, 100), np.random.uniform(1, 5, 100)
+        scurve_data = np.random.binomial(100, 0.5 * (erf((plsr_dac[np.newaxis, :] - mu[:, np.newaxis]) / (np.sqrt(2) * sigma[:, np.newaxis])) + 1)).astype(np.float64)
+        scurve_data[:10] = 0  # pixels without hits
+        result = np.array([fit_scurve(pixel_data, plsr_dac) for pixel_data in scurve_data])
+        self.assertTrue(np.allclose(fit_scurves_batched(scurve_data, plsr_dac), result, atol=1e-3))
+        # S-curves with a noise below the PlsrDAC step size, the noise is hardly constrained by the data
+        plsr_dac = np.arange(0, 100, 2, dtype=np.float64)
+        mu, sigma = np.random.uniform(20, 60, 100), np.random.uniform(0.1, 5, 100)
+        scurve_data = np.random.binomial(100, 0.5 * (erf((plsr_dac[np.newaxis, :] - mu[:, np.newaxis]) / (np.sqrt(2) * sigma[:, np.newaxis])) + 1)).astype(np.float64)
+        result = np.array([fit_scurve(pixel_data, plsr_dac) for pixel_data in scurve_data])
+        result_batched = fit_scurves_batched(scurve_data, plsr_dac)
+        wide = sigma > 2.0
+        self.assertTrue(np.allclose(result_batched[wide], result[wide], atol=1e-3))
+        self.assertTrue(np.allclose(result_batched[~wide, 0], result[~wide, 0], atol=1.0))  # threshold within half a PlsrDAC step
+        self.assertTrue(np.all(result_batched[~wide, 1] < 2.0) and np.all(result[~wide, 1] < 2.0))  # noise below the PlsrDAC step size
+
+    def test_scurve_start_values(self):  # check S-curve fit with k-means start values against fit with start values from the largest occupancy step
+        np.random.seed(0)
+        plsr_dac = np.arange(0, 100, dtype=np.float64)
+        mu, sigma = np.random.uniform(20, 60, 500), np.random.uniform(1, 5, 500)
+        scurve_data = np.random.binomial(100, 0.5 * (erf((plsr_dac[np.newaxis, :] - mu[:, np.newaxis]) / (np.sqrt(2) * sigma[:, np.newaxis])) + 1)).astype(np.float64)
+        scurve_data[:10] = 0  # pixels without hits
+        start_values = get_scurve_start_values(scurve_data, plsr_dac)
+        self.assertTrue(np.all(start_values[:10, 0] == 0))
+        index = np.argmax(np.diff(scurve_data[10:], axis=1), axis=1)
+        self.assertTrue(np.mean(np.abs(start_values[10:, 1] - mu[10:])) < np.mean(np.abs(plsr_dac[index] - mu[10:])))  # threshold start values are closer to the true threshold
+        self.assertTrue(np.allclose(fit_scurves_chunk(scurve_data, plsr_dac, start_values=start_values), fit_scurves_chunk(scurve_data, plsr_dac), rtol=1e-5, atol=1e-5))
+
     def test_hit_or_calibration(self):
         create_hitor_calibration(os.path.join(tests_data_folder, 'hit_or_calibration'), plot_pixel_calibrations=True)
         data_equal, error_msg = test_tools.compare_h5_files(os.path.join(tests_data_folder, 'hit_or_calibration_interpreted_result.h5'),